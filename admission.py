@@ -0,0 +1,271 @@
+# admission.py
+# Admission control in front of the browsers. A fixed number of browser
+# slots is shared by all scrapes; callers beyond that wait in a weighted
+# fair queue, and once the queue is full new callers get a quick 429 with
+# a Retry-After estimate instead of piling more Chromium work on the box.
+import os
+import math
+import logging
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from browser_pool import BROWSER_WORKERS
+
+# ------------------ Setup ------------------
+ADMISSION_SLOTS = int(os.environ.get("ADMISSION_SLOTS", BROWSER_WORKERS * 2))
+# Slots one client may hold at once; a /scrape/ holds one per site
+ADMISSION_PER_CLIENT = int(os.environ.get("ADMISSION_PER_CLIENT", 4))
+ADMISSION_QUEUE_LIMIT = int(os.environ.get("ADMISSION_QUEUE_LIMIT", 64))        # waiting requests, all clients
+ADMISSION_CLIENT_QUEUE_LIMIT = int(os.environ.get("ADMISSION_CLIENT_QUEUE_LIMIT", 8))
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", 30))
+# "client=weight,..." - a weight of 2 gets twice the share of a weight-1 client
+ADMISSION_WEIGHTS = os.environ.get("ADMISSION_WEIGHTS", "")
+# "key=client,..." - API keys callers send as X-Client-Id to be known by name
+ADMISSION_CLIENT_KEYS = os.environ.get("ADMISSION_CLIENT_KEYS", "")
+# Reverse proxies whose X-Client-Id / X-Forwarded-For headers are believed
+TRUSTED_PROXIES = {p.strip() for p in os.environ.get("TRUSTED_PROXIES", "").split(",") if p.strip()}
+WAIT_SAMPLES = 1000
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for part in spec.split(","):
+        if "=" in part:
+            client, weight = part.split("=", 1)
+            weights[client.strip()] = float(weight)
+    return weights
+
+
+def parse_client_keys(spec: str) -> Dict[str, str]:
+    keys = {}
+    for part in spec.split(","):
+        if "=" in part:
+            key, client = part.split("=", 1)
+            keys[key.strip()] = client.strip()
+    return keys
+
+
+CLIENT_KEYS = parse_client_keys(ADMISSION_CLIENT_KEYS)
+
+
+def resolve_client(peer: Optional[str], client_header: Optional[str] = None,
+                   forwarded_for: Optional[str] = None) -> str:
+    # Who limits and fair shares apply to. A caller-chosen id is only taken
+    # from a trusted proxy, otherwise a fresh id per request would dodge both.
+    if client_header and client_header in CLIENT_KEYS:
+        return CLIENT_KEYS[client_header]
+    if peer in TRUSTED_PROXIES:
+        if client_header:
+            return client_header
+        if forwarded_for:
+            return forwarded_for.split(",")[-1].strip()  # the address the proxy saw
+    return peer or "unknown"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, client: str, slots: int, finish_tag: float, bounded: bool,
+                 on_admit: Optional[Callable[["Ticket"], None]] = None):
+        self.client = client
+        self.slots = slots
+        self.finish_tag = finish_tag
+        self.bounded = bounded
+        self.on_admit = on_admit
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.event = threading.Event()
+
+
+class AdmissionController:
+    # Weighted fair queueing on virtual finish tags: a request's tag is its
+    # client's previous tag (or the current virtual time, whichever is later)
+    # plus cost / weight, and the waiting request with the smallest tag goes
+    # next. A client sending many or large scrapes only pushes its own tags
+    # back, so light callers keep getting served.
+
+    def __init__(self, slots: int = ADMISSION_SLOTS, per_client: int = ADMISSION_PER_CLIENT,
+                 queue_limit: int = ADMISSION_QUEUE_LIMIT, client_queue_limit: int = ADMISSION_CLIENT_QUEUE_LIMIT,
+                 weights: Optional[Dict[str, float]] = None):
+        self.slots = slots
+        self.per_client = per_client
+        self.queue_limit = queue_limit
+        self.client_queue_limit = client_queue_limit
+        self.weights = weights if weights is not None else parse_weights(ADMISSION_WEIGHTS)
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self.waiting: list[Ticket] = []
+        self.running: Dict[str, int] = {}      # client -> slots held
+        self.last_tag: Dict[str, float] = {}
+        self.batches: Dict[str, int] = {}      # client -> unfinished batches
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.service_seconds = 10.0            # moving average of how long a slot is held
+        self._waits: deque = deque(maxlen=WAIT_SAMPLES)
+        self._lock = threading.Lock()
+
+    def _retry_after(self) -> int:
+        # Rough time until the queue ahead has drained
+        rounds = (len(self.waiting) + 1) / max(1, self.slots)
+        return max(1, math.ceil(rounds * self.service_seconds))
+
+    def _dispatch(self) -> List[Ticket]:
+        # Admit waiting tickets in finish-tag order while slots are free. A
+        # client at its cap is skipped; a ticket that needs more slots than
+        # are free holds the line, so big requests aren't starved by small ones.
+        # Returns the admitted tickets, for _notify() once the lock is released.
+        admitted = []
+        for ticket in sorted(self.waiting, key=lambda t: t.finish_tag):
+            if self.running.get(ticket.client, 0) + ticket.slots > max(self.per_client, ticket.slots):
+                continue
+            if ticket.slots > self.slots - self.in_use:
+                break
+            self.waiting.remove(ticket)
+            self.in_use += ticket.slots
+            self.running[ticket.client] = self.running.get(ticket.client, 0) + ticket.slots
+            self.virtual_time = max(self.virtual_time, ticket.finish_tag)
+            ticket.admitted_at = time.monotonic()
+            self._waits.append(ticket.admitted_at - ticket.enqueued_at)
+            self.admitted += 1
+            admitted.append(ticket)
+        return admitted
+
+    def _notify(self, admitted: List[Ticket]):
+        for ticket in admitted:
+            ticket.event.set()
+            if ticket.on_admit is not None:
+                try:
+                    ticket.on_admit(ticket)
+                except Exception as e:
+                    logging.error(f"Admitted work for {ticket.client} could not start: {e}")
+                    self.release(ticket)
+
+    def _check(self, client: str):
+        # Queued scrapes and unfinished batches both count: batch units are
+        # queued without limits, so the batch itself is what gets limited.
+        queued = sum(1 for t in self.waiting if t.bounded) + sum(self.batches.values())
+        if queued >= self.queue_limit:
+            self.rejected += 1
+            raise AdmissionRejected("Scrape queue is full", self._retry_after())
+        mine = sum(1 for t in self.waiting if t.bounded and t.client == client) + self.batches.get(client, 0)
+        if mine >= self.client_queue_limit:
+            self.rejected += 1
+            raise AdmissionRejected("Too many queued scrapes for this client", self._retry_after())
+
+    def check(self, client: str):
+        # Raises AdmissionRejected if a new request from client would not be queued
+        with self._lock:
+            self._check(client)
+
+    def begin_batch(self, client: str):
+        # Counts a batch against client's queue limits until end_batch();
+        # raises AdmissionRejected like check()
+        with self._lock:
+            self._check(client)
+            self.batches[client] = self.batches.get(client, 0) + 1
+
+    def end_batch(self, client: str):
+        with self._lock:
+            left = self.batches.get(client, 0) - 1
+            if left > 0:
+                self.batches[client] = left
+            else:
+                self.batches.pop(client, None)
+
+    def _enqueue(self, client: str, cost: float, slots: int, bounded: bool,
+                 on_admit: Optional[Callable[[Ticket], None]] = None) -> Ticket:
+        if bounded:
+            self.check(client)
+        with self._lock:
+            weight = self.weights.get(client, 1.0)
+            start = max(self.virtual_time, self.last_tag.get(client, 0.0))
+            ticket = Ticket(client, min(slots, self.slots), start + cost / weight, bounded, on_admit)
+            self.last_tag[client] = ticket.finish_tag
+            self.waiting.append(ticket)
+            admitted = self._dispatch()
+        self._notify(admitted)
+        return ticket
+
+    def enqueue(self, client: str, on_admit: Callable[[Ticket], None], cost: float = 1.0, slots: int = 1) -> Ticket:
+        # Non-blocking admit for work that must not hold a thread while it
+        # waits (batch units): on_admit(ticket) runs once admitted, and the
+        # work calls release(ticket) when done. No queue limits, no timeout.
+        return self._enqueue(client, cost, slots, bounded=False, on_admit=on_admit)
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            self.in_use -= ticket.slots
+            held = self.running.get(ticket.client, 0) - ticket.slots
+            if held > 0:
+                self.running[ticket.client] = held
+            else:
+                self.running.pop(ticket.client, None)
+                if not any(t.client == ticket.client for t in self.waiting):
+                    self.last_tag.pop(ticket.client, None)
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * (time.monotonic() - ticket.admitted_at)
+            admitted = self._dispatch()
+        self._notify(admitted)
+
+    @contextmanager
+    def admit(self, client: str, cost: float = 1.0, slots: int = 1,
+              timeout: Optional[float] = ADMISSION_MAX_WAIT_SECONDS):
+        # cost is the expected work (page loads), slots the browser slots held
+        # while running
+        ticket = self._enqueue(client, cost, slots, bounded=True)
+        if not ticket.event.wait(timeout):
+            with self._lock:
+                admitted = None
+                if ticket.admitted_at is None:
+                    self.waiting.remove(ticket)
+                    self.timed_out += 1
+                    admitted = self._dispatch()
+                    retry_after = self._retry_after()
+            if admitted is not None:
+                self._notify(admitted)
+                raise AdmissionRejected("Timed out waiting for a browser slot", retry_after)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            queued: Dict[str, int] = {}
+            for t in self.waiting:
+                queued[t.client] = queued.get(t.client, 0) + 1
+            now = time.monotonic()
+            return {
+                "slots": self.slots,
+                "slots_in_use": self.in_use,
+                "queue_depth": len(self.waiting),
+                "oldest_wait_seconds": round(max((now - t.enqueued_at for t in self.waiting), default=0.0), 2),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_seconds": {
+                    "mean": round(sum(waits) / len(waits), 3) if waits else None,
+                    "p95": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3) if waits else None,
+                    "max": round(waits[-1], 3) if waits else None,
+                },
+                "avg_service_seconds": round(self.service_seconds, 2),
+                "batches": sum(self.batches.values()),
+                "clients": {c: {"running": self.running.get(c, 0), "queued": queued.get(c, 0),
+                                "batches": self.batches.get(c, 0)}
+                            for c in set(self.running) | set(queued) | set(self.batches)},
+            }
+
+
+_controller = AdmissionController()
+
+
+def get_admission_controller() -> AdmissionController:
+    return _controller
@@ -1,21 +1,56 @@
 # app_fastapi.py
 import io
+import os
 import csv
 import time
 import locale
 import logging
 import base64
+import uuid
+import threading
+import functools
+import itertools
 import requests
+import concurrent.futures
 import numpy as np
-from fastapi import FastAPI, UploadFile
-from pydantic import BaseModel
-from typing import List, Dict, Optional
-from playwright.sync_api import sync_playwright
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from pydantic import BaseModel, Field
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
 from sklearn.cluster import KMeans
 import matplotlib.pyplot as plt
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, RedirectResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from parse_pool import get_parse_pool
+from crawler import INCOMPLETE_STOPS, crawl, site_for_url
+from work_queue import get_work_queue
+from pagination import PaginationPlan, link_key
+from browser_pool import BROWSER_WORKERS, SCRAPER_BACKEND, close_browser_pool
+from rate_limiter import get_rate_limiter
+from price_stats import QueryStats, find_query_stats, normalize_query, start_query_stats
+from spill import MAX_ITEMS_PER_REQUEST, MAX_PAGES_PER_REQUEST, ItemSpool, RequestBudget
+from snapshot_store import url_query_and_page
+from single_flight import Flight, get_single_flight
+from excel_report import ExcelReportWriter, csv_to_xlsx
+from circuit_breaker import breaker_metrics
+from http_client import get_http_client
+from thumbnails import allowed_image, get_thumbnail_cache, thumbnail_path
+from admission import (ADMISSION_MAX_WAIT_SECONDS, ADMISSION_SLOTS, AdmissionRejected, Ticket,
+                       get_admission_controller, resolve_client)
+from deadline import (MAX_SCRAPE_DEADLINE_SECONDS, PAGE_TIMEOUT_SECONDS, RATES_TIMEOUT_SECONDS,
+                      RESPONSE_RESERVE_SECONDS, SCRAPE_DEADLINE_SECONDS, Deadline)
+
+try:
+    import orjson  # noqa: F401
+    JSONResponseClass = ORJSONResponse
+except ImportError:
+    JSONResponseClass = JSONResponse
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
 
 # ------------------ Setup ------------------
 locale.setlocale(locale.LC_ALL, "")
@@ -31,10 +66,62 @@ currency = "usd"
 currency_symbol = "$"
 remove_currency_from_csv = True
 api_url_for_currencies: dict = {}
+RATES_TTL_SECONDS = float(os.environ.get("RATES_TTL_SECONDS", 3600))
+_rates_cache: Dict[str, Tuple[float, dict]] = {}
+
+# "local" scrapes inside this process, "queue" hands pages to scrape_worker.py
+SCRAPE_MODE = os.environ.get("SCRAPE_MODE", "local")
+QUEUE_WAIT_SECONDS = float(os.environ.get("QUEUE_WAIT_SECONDS", 300))
+QUEUE_POLL_SECONDS = 0.5
+
+# Generated reports (CSV, xlsx, charts) - the only directory served under /files,
+# so runtime state (browser profiles, queue and thumbnail databases) never is
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "output")
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def output_path(name: str) -> str:
+    return os.path.join(OUTPUT_DIR, name)
 
 # ------------------ Utility Functions ------------------
 
-def convert_price(price_data: str, source_url: str) -> str:
+def get_rates(code: str, deadline: Optional[Deadline] = None) -> dict:
+    # Exchange rates barely move within an hour; share them across requests.
+    cached = _rates_cache.get(code)
+    if cached and time.time() - cached[0] < RATES_TTL_SECONDS:
+        return cached[1]
+    if SCRAPER_BACKEND == "fake":
+        from fake_scraper import fake_rates
+        return fake_rates(code)
+    try:
+        rates = get_http_client().get_json(
+            f"https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies/{code}.json",
+            timeout=RATES_TIMEOUT_SECONDS, deadline=deadline,
+        )
+    except (requests.RequestException, ValueError):
+        if cached:
+            # Stale rates beat failing the whole request
+            logging.warning(f"Could not refresh {code} rates, using ones from {time.ctime(cached[0])}")
+            return cached[1]
+        raise
+    _rates_cache[code] = (time.time(), rates)
+    return rates
+
+
+def currency_settings(code: str, remove_currency: bool = True, deadline: Optional[Deadline] = None) -> Dict:
+    # Everything convert_price needs, so concurrent requests don't share globals
+    return {
+        "currency": code,
+        "symbol": [k for k, v in symbols_hash_map.items() if v == code][0],
+        "remove_currency": remove_currency,
+        "rates": get_rates(code, deadline),
+    }
+
+
+def convert_price(price_data: str, source_url: str, settings: Optional[Dict] = None) -> str:
+    if settings is None:
+        settings = {"currency": currency, "symbol": currency_symbol,
+                    "remove_currency": remove_currency_from_csv, "rates": api_url_for_currencies}
     try:
         price_data = price_data.replace(u'\xa0', ' ').strip()
         # Extract currency symbol
@@ -62,12 +149,12 @@ def convert_price(price_data: str, source_url: str) -> str:
         amount = sum(numeric_values) / len(numeric_values) if numeric_values else 0.0
 
         # Convert to target currency
-        converted_amount = amount / api_url_for_currencies[currency][original_currency]
+        converted_amount = amount / settings["rates"][settings["currency"]][original_currency]
 
         return (
             f'{converted_amount:.2f}'
-            if remove_currency_from_csv
-            else f'{currency_symbol} {converted_amount:.2f}'
+            if settings["remove_currency"]
+            else f'{settings["symbol"]} {converted_amount:.2f}'
         )
     except Exception as e:
         logging.warning(f"Price conversion failed for '{price_data}': {e}")
@@ -93,74 +180,25 @@ def convert_price(price_data: str, source_url: str) -> str:
 #         return "0.00"
 
 # ------------------ Scrapers ------------------
-def parse_amazon(target_url) -> List[Dict]:
+def rows_to_items(rows: List[tuple], source: str, settings: Optional[Dict] = None) -> List[Dict]:
+    # Thumbnail points at our own cache (see /thumbnails/) when it is enabled
+    thumbnails = get_thumbnail_cache() is not None
     data: list = []
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(target_url)
-
-        items = page.query_selector_all('div.a-section.a-spacing-small')
-        for item in items:
-            try:
-                name_el = item.query_selector('h2.a-size-mini > a > span')
-                price_el = item.query_selector('span.a-price > span.a-offscreen')
-                link_el = item.query_selector('h2.a-size-mini > a')
-
-                if not (name_el and price_el and link_el):
-                    continue  # Skip if any critical element is missing
-
-                price = convert_price(price_el.inner_text(), 'amazon')
-                if price == '0.00':
-                    continue  # Skip malformed price
-
-                item_data = {
-                    'Name': name_el.inner_text(),
-                    'Price': price,
-                    'Link': f"https://amazon.com{link_el.get_attribute('href')}"
-                }
-                data.append(item_data)
-
-            except Exception:
-                continue  # Skip problematic items silently
-
-        browser.close()
+    for row in rows:
+        name, price_text, link = row[:3]
+        image = row[3] if len(row) > 3 else ""
+        price = convert_price(price_text, source, settings)
+        if price == '0.00':
+            continue  # Skip malformed price
+        data.append({'Name': name, 'Price': price, 'Link': link, 'Image': image,
+                     'Thumbnail': thumbnail_path(image) if thumbnails and allowed_image(image) else ""})
     return data
 
 
-def parse_ebay_playwright(target_url: str) -> List[Dict]:
-    data: list = []
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(target_url, wait_until="domcontentloaded")
-
-        items = page.query_selector_all('li.s-item')
-        for item in items:
-            try:
-                title_el = item.query_selector('div.s-item__title')
-                price_el = item.query_selector('span.s-item__price')
-                link_el = item.query_selector('a.s-item__link')
-
-                if not (title_el and price_el and link_el):
-                    continue  # Skip if any critical element is missing
-
-                price = convert_price(price_el.inner_text().strip(), 'ebay')
-                if price == '0.00':
-                    continue  # Skip malformed price
-
-                item_data = {
-                    'Name': title_el.inner_text().strip(),
-                    'Price': price,
-                    'Link': link_el.get_attribute('href')
-                }
-                data.append(item_data)
-
-            except Exception:
-                continue  # Skip problematic items silently
-
-        browser.close()
-    return data
+def queue_thumbnails(rows: List[tuple]):
+    cache = get_thumbnail_cache()
+    if cache is not None:
+        cache.enqueue(row[3] for row in rows if len(row) > 3)
 
 
 # def parse_amazon(target_url) -> List[Dict]:
@@ -185,52 +223,196 @@ def parse_ebay_playwright(target_url: str) -> List[Dict]:
 #     return data
 
 # def parse_ebay_playwright(target_url: str) -> List[Dict]:
-    data = []
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(target_url, wait_until="domcontentloaded")
-        items = page.query_selector_all("li.s-item")
-        for item in items:
-            try:
-                title = item.query_selector("div.s-item__title")
-                price = item.query_selector("span.s-item__price")
-                link = item.query_selector("a.s-item__link")
-                if title and price and link:
-                    data.append({
-                        "Name": title.inner_text().strip(),
-                        "Price": convert_price(price.inner_text().strip(), "ebay"),
-                        "Link": link.get_attribute("href")
-                    })
-            except Exception as e:
-                logging.warning(f"Skipping eBay item: {e}")
-        browser.close()
-    return data
+#     data = []
+#     with sync_playwright() as pw:
+#         browser = pw.chromium.launch(headless=True)
+#         page = browser.new_page()
+#         page.goto(target_url, wait_until="domcontentloaded")
+#         items = page.query_selector_all("li.s-item")
+#         for item in items:
+#             try:
+#                 title = item.query_selector("div.s-item__title")
+#                 price = item.query_selector("span.s-item__price")
+#                 link = item.query_selector("a.s-item__link")
+#                 if title and price and link:
+#                     data.append({
+#                         "Name": title.inner_text().strip(),
+#                         "Price": convert_price(price.inner_text().strip(), "ebay"),
+#                         "Link": link.get_attribute("href")
+#                     })
+#             except Exception as e:
+#                 logging.warning(f"Skipping eBay item: {e}")
+#         browser.close()
+#     return data
 
-def scrape_website(target_url: str, pages: int = 1, sleep_time: int = 1) -> List[Dict]:
+def crawl_site(site: str, plan: PaginationPlan, flight: Flight, deadline: Optional[Deadline] = None,
+               on_page: Optional[Callable[[tuple], None]] = None) -> Dict:
+    # The browser side of a crawl (crawler.py), shared by every caller
+    # following the flight: each page's new rows are published to it and
+    # the crawl stops early once no caller wants more pages.
+    def publish(entry):
+        queue_thumbnails(entry[2])
+        flight.publish(entry)
+        if on_page is not None:
+            on_page(entry)
+
+    return crawl(site, plan, deadline=deadline, on_page=publish, wanted=flight.wanted)
+
+
+def scrape_website(target_url: str, pages: int = 1, report: Optional[Dict] = None,
+                   settings: Optional[Dict] = None, stats: Optional[QueryStats] = None,
+                   sink: Optional[Callable[[List[Dict]], None]] = None,
+                   budget: Optional[RequestBudget] = None,
+                   deadline: Optional[Deadline] = None) -> List[Dict]:
+    # report, when given, is filled with how far the crawl got for this site.
+    # With a sink, each page's items are handed over instead of accumulated.
+    # "complete" is False when the crawl was cut short (deadline, block, caps).
+    # Identical crawls running at the same time are done once (single_flight.py),
+    # unless the running one's deadline ends before this caller's; every
+    # caller converts the shared raw rows with its own settings.
+    report = report if report is not None else {}
+    site = site_for_url(target_url)
+    report.update({"site": site, "pages_fetched": 0, "blocked": None, "stopped": None, "complete": False})
+    if site is None:
+        logging.warning(f"No parsing logic for {target_url}")
+        return []
+
+    plan = PaginationPlan(site, target_url, pages)
+    query, _ = url_query_and_page(site, target_url)
+    flight, leader = get_single_flight().join((site, normalize_query(query or target_url), plan.last_page), deadline)
     all_data = []
-    for page in range(1, pages + 1):
-        url = f"{target_url}&page={page}"
-        logging.info(f"Scraping {url}")
-        if "ebay.com" in target_url:
-            all_data.extend(parse_ebay_playwright(url))
-        elif "amazon.com" in target_url:
-            all_data.extend(parse_amazon(url))
-        time.sleep(sleep_time)
+    budget_stop = None
+
+    def consume(entry) -> bool:
+        # False once this caller wants no more pages
+        nonlocal budget_stop
+        page, nbytes, rows = entry
+        items = rows_to_items(rows, site, settings)
+        if budget is not None:
+            budget.charge_page(nbytes)
+            items = budget.take_items(items)
+        if stats is not None:
+            stats.add_items(site, items)
+        if sink is not None:
+            sink(items)
+        else:
+            all_data.extend(items)
+        report["pages_fetched"] = page
+        if budget is not None and budget.exhausted:
+            budget_stop = budget.exhausted
+            return False
+        return True
+
+    if leader:
+        def on_page(entry):
+            if budget_stop is None and not consume(entry):
+                flight.leave()  # the crawl goes on only if others follow it
+
+        try:
+            crawled = crawl_site(site, plan, flight, deadline, on_page)
+        except Exception as e:
+            get_single_flight().land(flight, error=e)
+            raise
+        get_single_flight().land(flight, crawled)
+    else:
+        logging.info(f"{site}: joining the crawl already running for '{query}'")
+        report["shared"] = True
+        try:
+            for entry in flight.follow(deadline):
+                if not consume(entry):
+                    break
+        except TimeoutError:
+            budget_stop = "deadline"
+        finally:
+            flight.leave()
+        crawled = flight.result or {}
+
+    report["blocked"] = crawled.get("blocked")
+    report["stopped"] = budget_stop or crawled.get("stopped")
+    report["complete"] = (report["blocked"] is None and budget_stop is None
+                          and crawled.get("stopped") not in INCOMPLETE_STOPS)
     return all_data
 
-def save_to_csv(data: List[Dict], filename: str = "output.csv"):
-    if not data:
+
+def search_urls(search_field: str) -> List[str]:
+    return [
+        f"https://amazon.com/s?k={search_field}&s=exact-aware-popularity-rank",
+        f"https://ebay.com/sch/i.html?_nkw={search_field}"
+    ]
+
+
+def plan_scrape_tasks(search_field: str, pages: int) -> List[Dict]:
+    # Same pagination as scrape_website, flattened into queue tasks. Workers
+    # scrape pages independently, so there is no early stop here.
+    tasks = []
+    for target_url in search_urls(search_field):
+        site = site_for_url(target_url)
+        plan = PaginationPlan(site, target_url, pages)
+        for page in plan.pages():
+            tasks.append({"site": site, "query": search_field, "page": page, "url": plan.url(page)})
+    return tasks
+
+
+def scrape_via_queue(search_field: str, pages: int, reports: Optional[Dict] = None,
+                     settings: Optional[Dict] = None, stats: Optional[QueryStats] = None,
+                     deadline: Optional[Deadline] = None, job_id: Optional[str] = None) -> List[Dict]:
+    # job_id, when given, lets the caller point clients at /jobs/{job_id}
+    queue = get_work_queue()
+    job_id = job_id or uuid.uuid4().hex
+    queue.put(job_id, plan_scrape_tasks(search_field, pages))
+    wait = Deadline(QUEUE_WAIT_SECONDS, parent=deadline)
+    while not queue.job_status(job_id)["finished"]:
+        if wait.expired:
+            cancelled = queue.cancel(job_id)
+            logging.warning(f"Job {job_id} not finished after {wait.elapsed():.0f}s, "
+                            f"cancelled {cancelled} queued page(s), returning partial results")
+            break
+        time.sleep(min(QUEUE_POLL_SECONDS, wait.remaining()))
+
+    reports = reports if reports is not None else {}
+    all_data = []
+    seen: Dict[str, set] = {}  # site -> link_keys already taken, as PaginationPlan.observe does
+    for task, rows in queue.job_results(job_id):
+        report = reports.setdefault(task["site"], {"site": task["site"], "pages_fetched": 0, "blocked": None,
+                                                   "stopped": None, "complete": True})
+        if task["status"] == "done":
+            report["pages_fetched"] += 1
+        elif task["status"] == "failed":
+            report["blocked"] = task["error"]
+            report["complete"] = False
+        else:
+            report["stopped"] = "deadline"
+            report["complete"] = False
+        site_seen = seen.setdefault(task["site"], set())
+        fresh = []
+        for row in rows:
+            key = link_key(row[2])
+            if key not in site_seen:
+                site_seen.add(key)
+                fresh.append(row)
+        rows = fresh
+        queue_thumbnails(rows)
+        items = rows_to_items(rows, task["site"], settings)
+        if stats is not None:
+            stats.add_items(task["site"], items)
+        all_data.extend(items)
+    return all_data
+
+def save_to_csv(data: Iterable[Dict], filename: str = "output.csv"):
+    # Accepts any iterable (e.g. an ItemSpool) and writes it row by row
+    rows = iter(data)
+    first = next(rows, None)
+    if first is None:
         return
-    keys = data[0].keys()
     with open(filename, "w", newline="", encoding="utf-8") as file:
-        writer = csv.DictWriter(file, fieldnames=keys)
+        writer = csv.DictWriter(file, fieldnames=first.keys())
         writer.writeheader()
-        writer.writerows(data)
+        writer.writerow(first)
+        writer.writerows(rows)
 
-def pie_graph_base64(data: List[Dict]) -> str:
+def pie_graph_png(data: List[Dict]) -> bytes:
     if not data:
-        return ""
+        return b""
     prices = []
     for item in data:
         try:
@@ -238,7 +420,7 @@ def pie_graph_base64(data: List[Dict]) -> str:
         except Exception:
             continue
     if len(prices) == 0:
-        return ""
+        return b""
 
     numpy_prices = np.array(prices).reshape(-1, 1)
     n_clusters = min(5, len(numpy_prices))
@@ -255,12 +437,202 @@ def pie_graph_base64(data: List[Dict]) -> str:
     buffer = io.BytesIO()
     plt.savefig(buffer, format="png")
     plt.close()
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return buffer.getvalue()
+
+
+def pie_graph_base64(data: List[Dict]) -> str:
+    png = pie_graph_png(data)
+    if not png:
+        return ""
+    img_base64 = base64.b64encode(png).decode("utf-8")
     return f"data:image/png;base64,{img_base64}"
 
+
+RESPONSE_FIELDS = {"counts", "preview", "items", "stats", "graph_link", "graph"}
+# What /scrape/ returned before field selection existed
+DEFAULT_FIELDS = ["counts", "preview", "graph"]
+# Larger previews belong in "items"
+MAX_PREVIEW_SIZE = int(os.environ.get("MAX_PREVIEW_SIZE", 100))
+
+
+def shape_response(spool: ItemSpool, site_reports: Dict, fields: List[str],
+                   stats: Optional[QueryStats] = None, budget: Optional[RequestBudget] = None) -> Dict:
+    # Only build what the client asked for; the chart is by far the most expensive part.
+    body: Dict = {"csv_file": "scraped_data.csv"}
+    if "counts" in fields:
+        body["items_found"] = len(spool)
+        body["sites"] = site_reports
+        if budget is not None:
+            body["limits"] = budget.to_dict()
+    if "preview" in fields:
+        body["data_preview"] = spool.preview
+    if "items" in fields:
+        body["items"] = list(spool)
+    if "stats" in fields and stats is not None:
+        body["stats"] = stats.summary()
+    # The chart clusters a bounded random sample, not every price
+    sample = spool.sample.items
+    if "graph" in fields:
+        body["graph_base64"] = pie_graph_base64(sample)
+    elif "graph_link" in fields:
+        png = pie_graph_png(sample)
+        if png:
+            with open(output_path("scraped_data_graph.png"), "wb") as f:
+                f.write(png)
+            body["graph_url"] = "/files/scraped_data_graph.png"
+        else:
+            body["graph_url"] = None
+    return body
+
+# ------------------ Batch ------------------
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", BROWSER_WORKERS * 2))
+MAX_BATCHES_KEPT = 100
+# Units only get here once admitted, so no more run at once than there are slots
+_batch_executor = ThreadPoolExecutor(max_workers=ADMISSION_SLOTS, thread_name_prefix="batch")
+# Sites of one /scrape/ request are crawled side by side, so the deadline
+# isn't spent on one marketplace while the other waits its turn.
+_site_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="site")
+_batches: Dict[str, "BatchJob"] = {}
+
+
+class BatchJob:
+    # Many queries scraped as (query, site) crawls on one shared executor. The
+    # browser pool and rate limiter bound throughput, not per-request setup.
+
+    def __init__(self, queries: List[str], pages: int, settings: Dict, keep_items: bool = True,
+                 client: str = "batch"):
+        self.batch_id = uuid.uuid4().hex
+        self.client = client
+        self.queries = list(dict.fromkeys(q.strip() for q in queries if q.strip()))
+        self.pages = pages
+        self.settings = settings
+        self.csv_file = f"batch_{self.batch_id}.csv"
+        self.csv_path = output_path(self.csv_file)
+        self.status = "running"
+        # Items only need to be kept when the caller waits for them; the CSV has them anyway
+        self.keep_items = keep_items
+        self.items: Dict[str, ItemSpool] = {q: ItemSpool() for q in self.queries}
+        self.budgets = {q: RequestBudget() for q in self.queries}
+        self.stats = {q: start_query_stats(q, settings["currency"]) for q in self.queries}
+        self.progress: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._csv = open(self.csv_path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._csv, fieldnames=["Query", "Name", "Price", "Link", "Image", "Thumbnail"],
+                                      extrasaction="ignore")
+        self._writer.writeheader()
+        self.futures = []
+
+    def start(self):
+        # Every query's progress exists before any unit runs, so the first
+        # unit to finish can't take the batch for done and close the CSV.
+        units = []
+        for query in self.queries:
+            if SCRAPE_MODE == "queue":
+                urls = [None]  # scrape_worker.py processes split the query into pages
+            else:
+                urls = search_urls(query)
+            self.progress[query] = {"units_total": len(urls), "units_done": 0, "items_found": 0, "sites": {}}
+            units.extend((query, url) for url in urls)
+        # Each unit queues for a browser slot like any /scrape/ from the same
+        # client and only takes an executor thread once admitted, so a big
+        # batch gets its fair share instead of every thread in turn.
+        for query, url in units:
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            self.futures.append(future)
+            get_admission_controller().enqueue(
+                self.client, functools.partial(self._start_unit, query, url, future), cost=self.pages, slots=1)
+
+    def _start_unit(self, query: str, url: Optional[str], future: concurrent.futures.Future, ticket: Ticket):
+        # Runs when admitted; if the unit can't start, the controller frees its slot
+        try:
+            _batch_executor.submit(self._run_unit, query, url, ticket, future)
+        except RuntimeError as e:
+            future.set_exception(e)
+            raise
+
+    def _run_unit(self, query: str, url: Optional[str], ticket: Ticket, future: concurrent.futures.Future):
+        try:
+            self._scrape_unit(query, url, ticket)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+    def _scrape_unit(self, query: str, url: Optional[str], ticket: Ticket):
+        reports: Dict[str, Dict] = {}
+        try:
+            if url is None:
+                items = self.budgets[query].take_items(
+                    scrape_via_queue(query, self.pages, reports, self.settings, self.stats[query]))
+            else:
+                report: Dict = {}
+                items = scrape_website(url, pages=self.pages, report=report, settings=self.settings,
+                                       stats=self.stats[query], budget=self.budgets[query])
+                reports[report["site"]] = report
+        except Exception as e:
+            logging.error(f"Batch {self.batch_id}: '{query}' failed on {url}: {e}")
+            items = []
+            reports[site_for_url(url or "") or "queue"] = {"error": str(e)}
+        finally:
+            get_admission_controller().release(ticket)
+        with self._lock:
+            self._writer.writerows({"Query": query, **item} for item in items)
+            self._csv.flush()
+            if self.keep_items:
+                self.items[query].extend(items)
+            progress = self.progress[query]
+            progress["units_done"] += 1
+            progress["items_found"] += len(items)
+            progress["sites"].update(reports)
+            if all(p["units_done"] == p["units_total"] for p in self.progress.values()):
+                self._csv.close()
+                self.status = "done"
+                get_admission_controller().end_batch(self.client)
+
+    def wait(self):
+        for future in self.futures:
+            future.result()
+
+    def discard(self):
+        # Removes the batch's files once it drops out of _batches
+        for path in (self.csv_path, output_path(f"batch_{self.batch_id}.xlsx")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def summary(self, include_items: bool = False) -> Dict:
+        # Returned items stop at MAX_ITEMS_PER_REQUEST for the whole batch, as
+        # for one /scrape/; the CSV always has every item.
+        with self._lock:
+            queries = {}
+            room = MAX_ITEMS_PER_REQUEST
+            for query, progress in self.progress.items():
+                queries[query] = dict(progress)
+                if include_items:
+                    items = list(itertools.islice(self.items[query], room))
+                    room -= len(items)
+                    queries[query]["items"] = items
+                    queries[query]["items_truncated"] = len(items) < len(self.items[query])
+                    self.items[query].close()
+            return {
+                "batch_id": self.batch_id,
+                "status": self.status,
+                "csv_file": self.csv_file,
+                "items_found": sum(p["items_found"] for p in self.progress.values()),
+                "queries": queries,
+            }
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
 # ------------------ FastAPI ------------------
-app = FastAPI()
+app = FastAPI(default_response_class=JSONResponseClass)
+
+# Big item lists compress 5-10x; tiny responses aren't worth the CPU.
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=1000, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # Allow your frontend domain
 origins = [
@@ -277,53 +649,262 @@ app.add_middleware(
     allow_headers=["*"],            # headers like Content-Type
 )
 
-app.mount("/files", StaticFiles(directory="."), name="files")
+app.mount("/files", StaticFiles(directory=OUTPUT_DIR), name="files")
 
 
 class ScrapeRequest(BaseModel):
     search_field: str
     currency: str = "usd"
     remove_currency: bool = True
-    pages: int = 3
+    pages: int = Field(3, ge=1, le=MAX_PAGES_PER_REQUEST)
+    # Any of counts, preview, items, stats, graph_link, graph
+    fields: Optional[List[str]] = None
+    preview_size: int = Field(5, ge=0, le=MAX_PREVIEW_SIZE)
+    # Also stream the items into scraped_data.xlsx (see /download_xlsx/)
+    excel: bool = False
+    # Seconds the whole request may take; whatever was scraped by then is returned
+    timeout: float = Field(SCRAPE_DEADLINE_SECONDS, gt=0, le=MAX_SCRAPE_DEADLINE_SECONDS)
 
-@app.post("/scrape/")
-def scrape(request: ScrapeRequest):
-    global currency, currency_symbol, remove_currency_from_csv, api_url_for_currencies
-    currency = request.currency.lower()
-    if currency not in symbols_hash_map.values():
-        return {"error": "Unsupported currency"}
-    currency_symbol = [k for k, v in symbols_hash_map.items() if v == currency][0]
-    remove_currency_from_csv = request.remove_currency
+def client_id(http_request: Request) -> str:
+    # The peer address, a known API key in X-Client-Id, or what a trusted proxy says
+    return resolve_client(http_request.client.host if http_request.client else None,
+                          http_request.headers.get("x-client-id"), http_request.headers.get("x-forwarded-for"))
 
-    api_url_for_currencies = requests.get(
-        f"https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies/{currency}.json"
-    ).json()
 
-    urls_to_scrape = [
-        f"https://amazon.com/s?k={request.search_field}&s=exact-aware-popularity-rank",
-        f"https://ebay.com/sch/i.html?_nkw={request.search_field}"
-    ]
+def too_busy(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
 
-    all_scraped_data = []
-    for url in urls_to_scrape:
-        all_scraped_data.extend(scrape_website(url, pages=request.pages))
 
-    # Save CSV
-    save_to_csv(all_scraped_data, "scraped_data.csv")
+@app.post("/scrape/")
+def scrape(request: ScrapeRequest, http_request: Request):
+    if request.currency.lower() not in symbols_hash_map.values():
+        return {"error": "Unsupported currency"}
+    fields = request.fields if request.fields is not None else DEFAULT_FIELDS
+    unknown = set(fields) - RESPONSE_FIELDS
+    if unknown:
+        return {"error": f"Unknown fields: {', '.join(sorted(unknown))}"}
+    deadline = Deadline(request.timeout)
+    # Hold one browser slot per site while scraping; waiting counts against
+    # the deadline, and a full queue answers 429 straight away.
+    sites = len(search_urls(request.search_field))
+    try:
+        with get_admission_controller().admit(
+                client_id(http_request), cost=request.pages * sites, slots=sites,
+                timeout=deadline.timeout(ADMISSION_MAX_WAIT_SECONDS)):
+            return run_scrape(request, fields, deadline)
+    except AdmissionRejected as e:
+        raise too_busy(e)
 
-    # Graph base64
-    graph_base64 = pie_graph_base64(all_scraped_data)
 
+def run_scrape(request: ScrapeRequest, fields: List[str], deadline: Deadline):
+    global currency, currency_symbol, remove_currency_from_csv, api_url_for_currencies
+    currency = request.currency.lower()
+    try:
+        settings = currency_settings(currency, request.remove_currency, deadline=deadline)
+    except (requests.RequestException, ValueError) as e:
+        raise HTTPException(status_code=503, detail=f"Exchange rates unavailable: {e}")
+    currency_symbol = settings["symbol"]
+    remove_currency_from_csv = request.remove_currency
+    api_url_for_currencies = settings["rates"]
+
+    # Items spill to disk past SPILL_THRESHOLD_ITEMS, so memory stays flat
+    # however many pages were asked for.
+    spool = ItemSpool(preview_size=request.preview_size)
+    budget = RequestBudget()
+    site_reports: Dict[str, Dict] = {}
+    stats = start_query_stats(request.search_field, currency)
+    excel = ExcelReportWriter(output_path("scraped_data.xlsx"), currency) if request.excel else None
+    # Scraping gets the deadline minus what writing the results needs
+    scrape_deadline = deadline.child(reserve=RESPONSE_RESERVE_SECONDS)
+    sink_lock = threading.Lock()
+    accepting = [True]
+    job_id = uuid.uuid4().hex if SCRAPE_MODE == "queue" else None
+
+    def sink(items: List[Dict]):
+        # Items from a crawl that overran the deadline are dropped
+        with sink_lock:
+            if not accepting[0]:
+                return
+            spool.extend(items)
+            if excel is not None:
+                excel.add_items(items)
+
+    try:
+        if SCRAPE_MODE == "queue":
+            # Pages are scraped by scrape_worker.py processes
+            sink(budget.take_items(scrape_via_queue(
+                request.search_field, request.pages, site_reports, settings, stats, scrape_deadline, job_id)))
+        else:
+            futures = {}
+            for url in search_urls(request.search_field):
+                report: Dict = {"site": site_for_url(url), "pages_fetched": 0, "complete": False}
+                site_reports[report["site"]] = report
+                futures[_site_executor.submit(
+                    scrape_website, url, pages=request.pages, report=report, settings=settings,
+                    stats=stats, sink=sink, budget=budget, deadline=scrape_deadline)] = report
+            done, late = concurrent.futures.wait(futures, timeout=scrape_deadline.remaining() + 1)
+            with sink_lock:
+                accepting[0] = False
+            for future in late:
+                # The crawl may still be winding down; report a copy of where it got to
+                future.cancel()
+                report = futures[future]
+                site_reports[report["site"]] = {**report, "stopped": "deadline", "complete": False}
+            for future in done:
+                if future.exception() is not None:
+                    logging.error(f"Scraping {futures[future]['site']} failed: {future.exception()}")
+                    futures[future].update({"error": str(future.exception()), "complete": False})
+
+        # Save CSV
+        save_to_csv(spool, output_path("scraped_data.csv"))
+        if excel is not None:
+            excel.close()
+            excel = None
+
+        # Returned directly so the item arrays skip FastAPI's generic encoder
+        body = shape_response(spool, site_reports, fields, stats, budget)
+        body["complete"] = all(r.get("complete") for r in site_reports.values())
+        body["deadline"] = deadline.to_dict()
+        if job_id is not None:
+            body["job_id"] = job_id  # page-level status at /jobs/{job_id}
+        if request.excel:
+            body["xlsx_file"] = "scraped_data.xlsx"
+        return JSONResponseClass(body)
+    finally:
+        spool.close()
+        if excel is not None:
+            excel.workbook.close()
+
+class BatchScrapeRequest(BaseModel):
+    queries: List[str]
+    currency: str = "usd"
+    remove_currency: bool = True
+    pages: int = Field(3, ge=1, le=MAX_PAGES_PER_REQUEST)
+    wait: bool = True
+
+@app.post("/scrape/batch")
+def scrape_batch(request: BatchScrapeRequest, http_request: Request):
+    code = request.currency.lower()
+    if code not in symbols_hash_map.values():
+        return {"error": "Unsupported currency"}
+    if not any(q.strip() for q in request.queries):
+        return {"error": "No queries given"}
+    client = client_id(http_request)
+    # Counted against the client's queue limits until its last unit is done
+    try:
+        get_admission_controller().begin_batch(client)
+    except AdmissionRejected as e:
+        raise too_busy(e)
+    try:
+        try:
+            settings = currency_settings(code, request.remove_currency)
+        except (requests.RequestException, ValueError) as e:
+            raise HTTPException(status_code=503, detail=f"Exchange rates unavailable: {e}")
+        job = BatchJob(request.queries, request.pages, settings, keep_items=request.wait, client=client)
+    except Exception:
+        get_admission_controller().end_batch(client)
+        raise
+    _batches[job.batch_id] = job
+    # Keep progress and files for the most recent batches only
+    for old_id in [b for b, j in _batches.items() if j.status == "done"][:-MAX_BATCHES_KEPT]:
+        _batches.pop(old_id).discard()
+    job.start()
+    if not request.wait:
+        return job.summary()
+    job.wait()
+    return job.summary(include_items=True)
+
+@app.get("/scrape/batch/{batch_id}")
+def scrape_batch_status(batch_id: str):
+    job = _batches.get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown batch")
+    return job.summary()
+
+@app.get("/stats")
+def query_stats(query: str, currency: str = "usd"):
+    # Sketch-based numbers for the latest scrape of a query, updated while it runs
+    stats = find_query_stats(query, currency.lower())
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No stats for this query yet")
+    return {"query": query, "currency": currency.lower(), **stats.summary()}
+
+@app.get("/metrics")
+def metrics():
     return {
-        "items_found": len(all_scraped_data),
-        "csv_file": "scraped_data.csv",
-        "graph_base64": graph_base64,
-        "data_preview": all_scraped_data[:5],
+        "circuit_breakers": breaker_metrics(),
+        "rate_limit_backlog_seconds": get_rate_limiter().backlog(),
+        "http_client": get_http_client().stats(),
+        "single_flight": get_single_flight().stats(),
+        "admission": get_admission_controller().metrics(),
+        "thumbnails": get_thumbnail_cache().metrics() if get_thumbnail_cache() else None,
     }
 
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_work_queue().job_status(job_id)
+
+@app.on_event("shutdown")
+def shutdown_pools():
+    get_parse_pool().shutdown()
+    close_browser_pool()
+    if get_thumbnail_cache() is not None:
+        get_thumbnail_cache().close()
+    get_http_client().close()
+
+# Thumbnails are stored under their content hash, so a URL never changes meaning
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@app.get("/thumbnails/by-url/{key}")
+def thumbnail_by_url(key: str):
+    # Item "Thumbnail" links land here; until the download is done the
+    # browser is sent to the marketplace image instead.
+    cache = get_thumbnail_cache()
+    found = cache.lookup(key) if cache is not None else None
+    if found is None or not allowed_image(found[0]):  # rows from before THUMBNAIL_HOSTS
+        raise HTTPException(status_code=404, detail="Unknown thumbnail")
+    image_url, digest = found
+    if digest:
+        return RedirectResponse(f"/thumbnails/{digest}.webp", status_code=301,
+                                headers={"Cache-Control": "public, max-age=604800"})
+    return RedirectResponse(image_url, status_code=307, headers={"Cache-Control": "no-store"})
+
+
+@app.get("/thumbnails/{digest}.webp")
+def thumbnail(digest: str):
+    cache = get_thumbnail_cache()
+    if cache is None or len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Unknown thumbnail")
+    path = cache.object_path(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Unknown thumbnail")
+    return FileResponse(path, media_type="image/webp",
+                        headers={"Cache-Control": THUMBNAIL_CACHE_CONTROL, "ETag": f'"{digest}"'})
+
 @app.get("/download_csv/")
 def download_csv():
-    return FileResponse("scraped_data.csv", media_type="text/csv", filename="scraped_data.csv")
+    return FileResponse(output_path("scraped_data.csv"), media_type="text/csv", filename="scraped_data.csv")
+
+@app.get("/download_xlsx/")
+def download_xlsx(batch_id: Optional[str] = None):
+    if batch_id:
+        job = _batches.get(batch_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown batch")
+        if job.status != "done":
+            raise HTTPException(status_code=409, detail="Batch still running")
+        csv_path, xlsx_path, code = job.csv_path, output_path(f"batch_{batch_id}.xlsx"), job.settings["currency"]
+    else:
+        csv_path, xlsx_path, code = output_path("scraped_data.csv"), output_path("scraped_data.xlsx"), currency
+    # Reports streamed during /scrape/ are served as-is; otherwise convert the CSV once
+    if not os.path.exists(xlsx_path) or (
+            os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(xlsx_path)):
+        if not os.path.exists(csv_path):
+            raise HTTPException(status_code=404, detail="Nothing scraped yet")
+        csv_to_xlsx(csv_path, xlsx_path, code)
+    # FileResponse sends the file in chunks, it is never read into memory whole
+    return FileResponse(xlsx_path, media_type=XLSX_MEDIA_TYPE, filename=os.path.basename(xlsx_path))
 
 
 # import sys
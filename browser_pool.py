@@ -0,0 +1,227 @@
+# browser_pool.py
+import os
+import json
+import time
+import queue
+import shutil
+import fcntl
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional, Tuple
+from playwright.sync_api import sync_playwright
+
+# ------------------ Setup ------------------
+BROWSER_WORKERS = int(os.environ.get("BROWSER_WORKERS", 2))
+BROWSER_STATE_DIR = os.environ.get("BROWSER_STATE_DIR", "browser_state")
+CONTEXT_MAX_AGE_SECONDS = float(os.environ.get("CONTEXT_MAX_AGE_SECONDS", 6 * 3600))
+CONTEXT_MAX_PAGES = int(os.environ.get("CONTEXT_MAX_PAGES", 500))
+STATE_SAVE_INTERVAL_SECONDS = 60
+# "browser" drives Chromium; "fake" makes up pages for load tests (fake_scraper.py)
+SCRAPER_BACKEND = os.environ.get("SCRAPER_BACKEND", "browser")
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+def state_file(site: str) -> str:
+    # Cookies and localStorage shared by every profile of a site
+    return os.path.join(BROWSER_STATE_DIR, f"{site}.storage.json")
+
+
+class SiteContext:
+    # A persistent Chromium profile for one site, owned by one pool thread.
+    # The profile directory keeps the HTTP disk cache and cookies across
+    # restarts; storage_state is exported so new profiles start warm too.
+
+    def __init__(self, pw, site: str, generation: int):
+        self.site = site
+        self.generation = generation
+        self.created_at = time.time()
+        self.pages = 0
+        self.last_saved = 0.0
+        self.profile_dir, self._lock_file = self._claim_profile_dir(site)
+        fresh = not os.path.isdir(os.path.join(self.profile_dir, "Default"))
+        self.context = pw.chromium.launch_persistent_context(
+            self.profile_dir, headless=True, user_agent=USER_AGENT,
+        )
+        if fresh:
+            self._seed_from_shared_state()
+
+    @staticmethod
+    def _claim_profile_dir(site: str):
+        # Chromium refuses to share a profile, so every thread (and every
+        # scrape_worker.py process on the host) takes its own numbered slot.
+        os.makedirs(BROWSER_STATE_DIR, exist_ok=True)
+        slot = 0
+        while True:
+            path = os.path.join(BROWSER_STATE_DIR, f"{site}-{slot}")
+            lock_file = open(f"{path}.lock", "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return path, lock_file
+            except BlockingIOError:
+                lock_file.close()
+                slot += 1
+
+    def _seed_from_shared_state(self):
+        try:
+            with open(state_file(self.site), encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("cookies"):
+            self.context.add_cookies(state["cookies"])
+        for origin in state.get("origins", []):
+            items = {i["name"]: i["value"] for i in origin.get("localStorage", [])}
+            if items:
+                self.context.add_init_script(
+                    f"if (location.origin === {json.dumps(origin['origin'])}) {{"
+                    f" for (const [k, v] of Object.entries({json.dumps(items)}))"
+                    f" if (localStorage.getItem(k) === null) localStorage.setItem(k, v); }}"
+                )
+        logging.info(f"Seeded new {self.site} profile from saved storage state")
+
+    def expired(self, generation: int) -> bool:
+        return (generation != self.generation
+                or self.pages >= CONTEXT_MAX_PAGES
+                or time.time() - self.created_at >= CONTEXT_MAX_AGE_SECONDS)
+
+    def load(self, url: str, wait_until: str, timeout_ms: Optional[float]) -> Tuple[Optional[int], bytes]:
+        page = self.context.new_page()
+        try:
+            response = page.goto(url, wait_until=wait_until, timeout=timeout_ms)
+            html = page.content()
+        finally:
+            page.close()
+        self.pages += 1
+        if time.time() - self.last_saved > STATE_SAVE_INTERVAL_SECONDS:
+            self.save_state()
+        return (response.status if response else None), html.encode("utf-8")
+
+    def save_state(self):
+        path = state_file(self.site)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self.context.storage_state(path=tmp)
+            os.replace(tmp, path)
+            self.last_saved = time.time()
+        except Exception as e:
+            logging.warning(f"Could not save {self.site} storage state: {e}")
+
+    def close(self, discard: bool = False):
+        try:
+            if not discard:
+                self.save_state()
+            self.context.close()
+        except Exception as e:
+            logging.warning(f"Error closing {self.site} context: {e}")
+        if discard:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self._lock_file.close()
+
+# ------------------ Pool ------------------
+
+class BrowserPool:
+    # Playwright's sync API is bound to the thread that started it, so each
+    # pool thread owns its own Playwright instance and per-site contexts.
+
+    def __init__(self, workers: int = BROWSER_WORKERS):
+        self.workers = workers
+        self._jobs: queue.Queue = queue.Queue()
+        self._generations: dict[str, int] = {}
+        self._discard: set = set()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"browser-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, url: str, site: str, wait_until: str = "load", timeout_ms: Optional[float] = None) -> Future:
+        future: Future = Future()
+        self._jobs.put((future, url, site, wait_until, timeout_ms))
+        return future
+
+    def fetch(self, url: str, site: str, wait_until: str = "load", timeout_ms: Optional[float] = None) -> Tuple[Optional[int], bytes]:
+        return self.submit(url, site, wait_until, timeout_ms).result()
+
+    def rotate(self, site: str, discard: bool = True):
+        # Called when a site blocks us: every thread drops its profile for the
+        # site, and the shared state is thrown away with it.
+        with self._lock:
+            self._generations[site] = self._generations.get(site, 0) + 1
+            if discard:
+                self._discard.add(site)
+                try:
+                    os.remove(state_file(site))
+                except OSError:
+                    pass
+        logging.info(f"Rotating browser contexts for {site}")
+
+    def _generation(self, site: str) -> int:
+        with self._lock:
+            return self._generations.get(site, 0)
+
+    def _context_for(self, pw, contexts: dict, site: str) -> SiteContext:
+        generation = self._generation(site)
+        ctx = contexts.get(site)
+        if ctx is not None and ctx.expired(generation):
+            with self._lock:
+                discard = site in self._discard and ctx.generation != generation
+            ctx.close(discard=discard)
+            ctx = None
+        if ctx is None:
+            ctx = contexts[site] = SiteContext(pw, site, generation)
+        return ctx
+
+    def _run(self):
+        with sync_playwright() as pw:
+            contexts: dict[str, SiteContext] = {}
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                future, url, site, wait_until, timeout_ms = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    ctx = self._context_for(pw, contexts, site)
+                    future.set_result(ctx.load(url, wait_until, timeout_ms))
+                except Exception as e:
+                    if "closed" in str(e).lower() and site in contexts:
+                        # Browser crashed or was killed, start over next time
+                        contexts.pop(site).close()
+                    future.set_exception(e)
+            for ctx in contexts.values():
+                ctx.close()
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join(timeout=30)
+
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if SCRAPER_BACKEND == "fake":
+                from fake_scraper import FakeBrowserPool
+                _pool = FakeBrowserPool()
+            else:
+                _pool = BrowserPool()
+        return _pool
+
+
+def close_browser_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,151 @@
+# circuit_breaker.py
+import os
+import time
+import random
+import logging
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+# ------------------ Setup ------------------
+BLOCK_THRESHOLD = int(os.environ.get("BLOCK_THRESHOLD", 2))        # consecutive blocks before opening
+BACKOFF_BASE_SECONDS = float(os.environ.get("BLOCK_BACKOFF_BASE", 30))
+BACKOFF_MAX_SECONDS = float(os.environ.get("BLOCK_BACKOFF_MAX", 900))
+PROBE_TIMEOUT_SECONDS = 120
+
+BLOCK_STATUSES = {403, 429, 503}
+
+# Text that only shows up on robot-check / interstitial pages
+CAPTCHA_MARKERS = {
+    "amazon": (
+        "/errors/validateCaptcha",
+        "Enter the characters you see below",
+        "To discuss automated access to Amazon data",
+    ),
+    "ebay": (
+        "Pardon Our Interruption",
+        "/splashui/challenge",
+        "Please verify yourself to continue",
+    ),
+}
+
+# Present on a real results page even when the search matched nothing
+RESULT_CONTAINER_MARKERS = {
+    "amazon": ("s-search-results", "s-result-item", "s-no-results"),
+    "ebay": ("srp-results", "srp-save-null-search", "s-item"),
+}
+
+
+class BlockedError(Exception):
+    pass
+
+
+def domain_of(url: str) -> str:
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def detect_block(site: str, status: Optional[int], html: bytes, rows: list) -> Optional[str]:
+    # Returns why the page looks like a block, or None for a normal page.
+    if status in BLOCK_STATUSES:
+        return f"HTTP {status}"
+    text = html.decode("utf-8", errors="ignore") if isinstance(html, bytes) else html
+    for marker in CAPTCHA_MARKERS.get(site, ()):
+        if marker in text:
+            return "captcha"
+    if not rows and not any(m in text for m in RESULT_CONTAINER_MARKERS.get(site, ())):
+        return "no result container"
+    return None
+
+# ------------------ Breaker ------------------
+
+class CircuitBreaker:
+    # closed: requests flow. open: skip the domain until the backoff expires.
+    # half_open: one probe request decides whether to close or re-open.
+
+    def __init__(self, domain: str, threshold: int = BLOCK_THRESHOLD,
+                 base_backoff: float = BACKOFF_BASE_SECONDS, max_backoff: float = BACKOFF_MAX_SECONDS):
+        self.domain = domain
+        self.threshold = threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = "closed"
+        self.consecutive_blocks = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.last_reason: Optional[str] = None
+        self.probe_in_flight = False
+        self.probe_started = 0.0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.time()
+            if self.state == "open" and now >= self.open_until:
+                self.state = "half_open"
+                self.probe_in_flight = False
+            if self.state == "closed":
+                return True
+            # A probe that never reported back (crash, timeout) must not wedge the breaker
+            if self.state == "half_open" and (not self.probe_in_flight or now - self.probe_started > PROBE_TIMEOUT_SECONDS):
+                self.probe_in_flight = True
+                self.probe_started = now
+                return True
+            self.skipped += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logging.info(f"Circuit for {self.domain} closed")
+            self.state = "closed"
+            self.consecutive_blocks = 0
+            self.trips = 0
+            self.probe_in_flight = False
+
+    def record_block(self, reason: str):
+        with self._lock:
+            self.consecutive_blocks += 1
+            self.last_reason = reason
+            if self.state == "half_open" or self.consecutive_blocks >= self.threshold:
+                # Exponential backoff with jitter so replicas do not retry in lockstep
+                backoff = min(self.max_backoff, self.base_backoff * (2 ** self.trips))
+                delay = random.uniform(backoff / 2, backoff)
+                self.trips += 1
+                self.state = "open"
+                self.open_until = time.time() + delay
+                self.probe_in_flight = False
+                logging.warning(f"Circuit for {self.domain} opened for {delay:.0f}s ({reason})")
+
+    def retry_after(self) -> float:
+        return max(0.0, self.open_until - time.time()) if self.state == "open" else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_blocks": self.consecutive_blocks,
+                "trips": self.trips,
+                "retry_after": round(self.retry_after(), 1),
+                "last_reason": self.last_reason,
+                "skipped": self.skipped,
+            }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    domain = domain_of(url)
+    with _breakers_lock:
+        if domain not in _breakers:
+            _breakers[domain] = CircuitBreaker(domain)
+        return _breakers[domain]
+
+
+def breaker_metrics() -> dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.domain: b.snapshot() for b in breakers}
@@ -0,0 +1,175 @@
+# crawler.py
+# The crawl loop shared by the API (app_fastapi.py), the queue workers
+# (scrape_worker.py) and the batch CLI (products_webscrap.py):
+#   circuit breaker -> politeness delay -> page load -> snapshot -> parse
+#   -> block detection -> pagination plan
+# Pages come from the browser pool, or for sites that render without
+# JavaScript, from the pooled HTTP client.
+import logging
+import concurrent.futures
+from typing import Callable, Dict, List, Optional, Tuple
+import requests
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from parse_pool import get_parse_pool
+from pagination import PaginationPlan
+from rate_limiter import get_rate_limiter
+from browser_pool import get_browser_pool
+from http_client import get_http_client
+from snapshot_store import get_snapshot_store
+from circuit_breaker import BlockedError, detect_block, get_breaker
+from deadline import MIN_PAGE_SECONDS, PAGE_TIMEOUT_SECONDS, Deadline
+
+# ------------------ Setup ------------------
+SITE_WAIT_UNTIL = {"amazon": "load", "ebay": "domcontentloaded"}
+
+# Crawl endings that leave pages unscraped
+INCOMPLETE_STOPS = ("deadline", "page timeout", "no callers left")
+
+# (url, site, deadline) -> (HTTP status, html)
+Fetcher = Callable[[str, str, Optional[Deadline]], Tuple[Optional[int], bytes]]
+
+
+class PageError(Exception):
+    pass
+
+
+def site_for_url(target_url: str) -> Optional[str]:
+    if "ebay.com" in target_url:
+        return "ebay"
+    elif "amazon.com" in target_url:
+        return "amazon"
+    return None
+
+# ------------------ Fetchers ------------------
+
+def load_page_before(target_url: str, site: str, deadline: Deadline) -> Tuple[Optional[int], bytes]:
+    # Raises TimeoutError when the deadline passes first; a load still queued
+    # for a browser is cancelled, a running one ends at its own timeout.
+    timeout_ms = deadline.page_timeout_ms()
+    if timeout_ms is None:
+        raise TimeoutError("No time left for another page")
+    future = get_browser_pool().submit(target_url, site, wait_until=SITE_WAIT_UNTIL[site], timeout_ms=timeout_ms)
+    try:
+        return future.result(timeout=deadline.remaining())
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"Deadline reached waiting for {target_url}")
+
+
+def browser_fetch(url: str, site: str, deadline: Optional[Deadline] = None) -> Tuple[Optional[int], bytes]:
+    # Pages load in warm, per-site persistent contexts (see browser_pool.py)
+    if deadline is not None:
+        return load_page_before(url, site, deadline)
+    return get_browser_pool().fetch(url, site, wait_until=SITE_WAIT_UNTIL[site],
+                                    timeout_ms=PAGE_TIMEOUT_SECONDS * 1000)
+
+
+def http_fetch(url: str, site: str, deadline: Optional[Deadline] = None) -> Tuple[Optional[int], bytes]:
+    # The status is handed back rather than raised, so 403/429/503 count as blocks
+    response = get_http_client().get(url, timeout=PAGE_TIMEOUT_SECONDS, deadline=deadline)
+    return response.status_code, response.content
+
+
+def record_snapshot(site: str, url: str, status: Optional[int], html: bytes, page: Optional[int] = None):
+    # Keep the raw page for offline re-parsing (snapshot_store.py replay)
+    store = get_snapshot_store()
+    if store is None:
+        return
+    try:
+        store.save(site, url, status, html, page=page)
+    except Exception as e:
+        logging.warning(f"Could not snapshot {url}: {e}")
+
+
+def check_page(site: str, url: str, status: Optional[int], html: bytes, rows: list, fetch: Fetcher) -> Optional[str]:
+    # Feeds the page to the breaker; returns the block reason, raises PageError
+    # for other failed HTTP responses (a browser page keeps whatever it rendered).
+    breaker = get_breaker(url)
+    reason = detect_block(site, status, html, rows)
+    if reason:
+        breaker.record_block(reason)
+        if fetch is browser_fetch:
+            get_browser_pool().rotate(site)  # only browser profiles carry state worth dropping
+        return reason
+    if fetch is not browser_fetch and status is not None and status >= 400:
+        raise PageError(f"HTTP {status} for {url}")
+    breaker.record_success()
+    return None
+
+# ------------------ Crawls ------------------
+
+def scrape_page(url: str, site: str, fetch: Fetcher = browser_fetch) -> List[tuple]:
+    # One (site, query, page) unit of work; returns unconverted item tuples.
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        raise BlockedError(f"{breaker.domain} is blocking us, retry in {breaker.retry_after():.0f}s")
+    status, html = fetch(url, site, None)
+    record_snapshot(site, url, status, html)
+    rows = get_parse_pool().parse(html, site)
+    reason = check_page(site, url, status, html, rows, fetch)
+    if reason:
+        raise BlockedError(f"{breaker.domain} blocked page load ({reason})")
+    return rows
+
+
+def crawl(site: str, plan: PaginationPlan, fetch: Fetcher = browser_fetch, deadline: Optional[Deadline] = None,
+          on_page: Optional[Callable[[tuple], None]] = None,
+          wanted: Optional[Callable[[], bool]] = None) -> Dict:
+    # Walks the plan's pages, handing (page, html size, new rows) to on_page,
+    # and returns how far it got. Stops early once wanted() says no caller
+    # needs more pages.
+    pool = get_parse_pool()
+    limiter = get_rate_limiter()
+    breaker = get_breaker(plan.target_url)
+    report = {"site": site, "pages_fetched": 0, "blocked": None, "stopped": None}
+    for page in plan.pages():
+        if wanted is not None and not wanted():
+            report["stopped"] = "no callers left"
+            break
+        if deadline is not None and deadline.page_timeout_ms() is None:
+            report["stopped"] = "deadline"
+            break
+        if not breaker.allow():
+            # Skip fast and keep whatever the earlier pages produced
+            report["blocked"] = f"circuit open, retry in {breaker.retry_after():.0f}s"
+            logging.warning(f"Skipping {breaker.domain}: {report['blocked']}")
+            break
+        url = plan.url(page)
+        # Politeness delay, shared with every other request; a slot that only
+        # comes up after the deadline leaves no time to load the page
+        max_wait = None if deadline is None else deadline.remaining() - MIN_PAGE_SECONDS
+        if not limiter.acquire(site, max_wait):
+            report["stopped"] = "deadline"
+            break
+        logging.info(f"Scraping {url}")
+        try:
+            status, html = fetch(url, site, deadline)
+        except (TimeoutError, PlaywrightTimeoutError, requests.Timeout) as e:
+            # Playwright's TimeoutError is not the builtin one. Either way the
+            # pages so far are kept and the followers get this report.
+            logging.warning(f"{site}: stopping at page {page}: {e}")
+            out_of_time = deadline is not None and deadline.page_timeout_ms() is None
+            report["stopped"] = "deadline" if out_of_time else "page timeout"
+            break
+        except requests.RequestException as e:
+            logging.error(f"Error fetching {url}: {e}")
+            report["stopped"] = f"page {page} could not be fetched"
+            break
+        record_snapshot(site, url, status, html, page=page)
+        rows = pool.parse(html, site)
+        try:
+            reason = check_page(site, url, status, html, rows, fetch)
+        except PageError as e:
+            logging.error(str(e))
+            report["stopped"] = f"page {page} could not be fetched"
+            break
+        if reason:
+            report["blocked"] = reason
+            logging.warning(f"{breaker.domain} blocked page {page} ({reason})")
+            break
+        report["pages_fetched"] = page
+        entry = (page, len(html), plan.observe(page, html, rows))
+        if on_page is not None:
+            on_page(entry)
+    report["stopped"] = report["stopped"] or plan.stopped_reason
+    return report
@@ -0,0 +1,57 @@
+# deadline.py
+import os
+import time
+from typing import Optional
+
+# ------------------ Setup ------------------
+# Total time one /scrape/ request may take, unless the client asks for less
+SCRAPE_DEADLINE_SECONDS = float(os.environ.get("SCRAPE_DEADLINE_SECONDS", 60))
+MAX_SCRAPE_DEADLINE_SECONDS = float(os.environ.get("MAX_SCRAPE_DEADLINE_SECONDS", 300))
+# Upper bound for a single page load, whatever is left of the deadline
+PAGE_TIMEOUT_SECONDS = float(os.environ.get("PAGE_TIMEOUT_SECONDS", 20))
+# Not worth starting a page load with less time than this left
+MIN_PAGE_SECONDS = float(os.environ.get("MIN_PAGE_SECONDS", 2))
+# Kept back from scraping for the CSV, chart and response
+RESPONSE_RESERVE_SECONDS = float(os.environ.get("RESPONSE_RESERVE_SECONDS", 3))
+RATES_TIMEOUT_SECONDS = float(os.environ.get("RATES_TIMEOUT_SECONDS", 5))
+
+
+class Deadline:
+    # A point in time (monotonic clock) that work has to finish by. Stages
+    # get child deadlines that never outlast their parent.
+
+    def __init__(self, seconds: float, parent: Optional["Deadline"] = None):
+        self.budget = seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def child(self, seconds: Optional[float] = None, reserve: float = 0.0) -> "Deadline":
+        # At most `seconds`, and always leaves `reserve` of this deadline unused
+        available = max(0.0, self.remaining() - reserve)
+        return Deadline(available if seconds is None else min(seconds, available), parent=self)
+
+    def timeout(self, cap: float) -> float:
+        # For APIs that take a timeout instead of a deadline
+        return min(cap, self.remaining())
+
+    def page_timeout_ms(self) -> Optional[float]:
+        # None when there is no point starting another page load
+        remaining = self.remaining()
+        if remaining < MIN_PAGE_SECONDS:
+            return None
+        return min(PAGE_TIMEOUT_SECONDS, remaining) * 1000
+
+    def to_dict(self) -> dict:
+        return {"budget_seconds": round(self.budget, 2), "elapsed_seconds": round(self.elapsed(), 2)}
@@ -0,0 +1,151 @@
+# excel_report.py
+# Streaming .xlsx price-comparison report. xlsxwriter's constant_memory mode
+# flushes each row to a temp file as soon as the next one starts, so memory
+# does not depend on the number of items.
+import csv
+import logging
+from typing import Dict, Iterable, List, Optional
+import xlsxwriter
+from circuit_breaker import domain_of
+from price_stats import PriceSketch
+
+COLUMN_WIDTHS = {"Query": 24, "Source": 10, "Name": 70, "Price": 12, "Link": 60}
+
+
+def source_of(link: str) -> str:
+    # "www.ebay.com" -> "ebay"
+    domain = domain_of(link)
+    return domain.split(".")[0] if domain else "other"
+
+
+class ExcelReportWriter:
+
+    def __init__(self, path: str, currency: str = "usd", columns: Optional[List[str]] = None):
+        self.path = path
+        self.currency = currency.upper()
+        self.columns = columns or ["Name", "Price", "Link"]
+        # Scraped text is written as text: a listing named "=HYPERLINK(...)" must not become a formula
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_urls": False,
+                                                   "strings_to_formulas": False})
+        self.header_fmt = self.workbook.add_format({"bold": True, "bg_color": "#DDEBF7", "border": 1})
+        self.price_fmt = self.workbook.add_format({"num_format": "#,##0.00"})
+        self.sheets: Dict[str, list] = {}  # name -> [worksheet, next row]
+        self.sketches: Dict[str, PriceSketch] = {}
+        self._add_sheet("All items", ["Source"] + self.columns)
+
+    def _add_sheet(self, name: str, columns: List[str]):
+        sheet = self.workbook.add_worksheet(name[:31])
+        for col, title in enumerate(columns):
+            sheet.set_column(col, col, COLUMN_WIDTHS.get(title, 16))
+            sheet.write(0, col, title, self.header_fmt)
+        sheet.freeze_panes(1, 0)
+        self.sheets[name] = [sheet, 1, columns]
+
+    def _write_row(self, name: str, values: list):
+        entry = self.sheets[name]
+        sheet, row, columns = entry
+        for col, (title, value) in enumerate(zip(columns, values)):
+            if title == "Price" and isinstance(value, float):
+                sheet.write_number(row, col, value, self.price_fmt)
+            else:
+                sheet.write(row, col, value)
+        entry[1] = row + 1
+
+    def add_items(self, items: Iterable[Dict]):
+        for item in items:
+            source = item.get("Source") or source_of(item.get("Link", ""))
+            values = []
+            for column in self.columns:
+                value = item.get(column, "")
+                if column == "Price":
+                    try:
+                        value = float(str(value).split()[-1])
+                    except (ValueError, IndexError):
+                        pass
+                values.append(value)
+            if source not in self.sheets:
+                self._add_sheet(source, self.columns)
+                self.sketches[source] = PriceSketch()
+            self._write_row("All items", [source] + values)
+            self._write_row(source, values)
+            price = values[self.columns.index("Price")] if "Price" in self.columns else None
+            if isinstance(price, float):
+                self.sketches[source].add(price)
+
+    def _write_summary(self):
+        summary = self.workbook.add_worksheet("Summary")
+        summary.activate()
+        summary.set_first_sheet()
+        headers = ["Source", "Items", "Min", "P25", "Median", "P75", "Max", "Mean"]
+        for col, title in enumerate(headers):
+            summary.set_column(col, col, 12)
+            summary.write(0, col, title, self.header_fmt)
+        sources = [s for s, sketch in self.sketches.items() if sketch.moments.count]
+        for row, source in enumerate(sources, start=1):
+            sketch = self.sketches[source]
+            q = sketch.digest.quantile
+            summary.write(row, 0, source)
+            summary.write_number(row, 1, sketch.moments.count)
+            for col, value in enumerate([sketch.moments.min, q(0.25), q(0.5), q(0.75),
+                                         sketch.moments.max, sketch.moments.mean], start=2):
+                summary.write_number(row, col, value, self.price_fmt)
+        if not sources:
+            return
+        last = len(sources)
+
+        # Native chart: price spread per source, read straight from the table above
+        spread = self.workbook.add_chart({"type": "column"})
+        for col, color in ((2, "#A9D08E"), (4, "#5B9BD5"), (7, "#F4B183"), (6, "#C00000")):
+            spread.add_series({
+                "name": ["Summary", 0, col],
+                "categories": ["Summary", 1, 0, last, 0],
+                "values": ["Summary", 1, col, last, col],
+                "fill": {"color": color},
+            })
+        spread.set_title({"name": f"Price comparison by source ({self.currency})"})
+        spread.set_y_axis({"name": self.currency, "num_format": "#,##0"})
+        summary.insert_chart(last + 3, 0, spread, {"x_scale": 1.6, "y_scale": 1.3})
+
+        # Price-band distribution: shared histogram bins, one column per source
+        band_row = last + 25
+        bins = PriceSketch().histogram
+        for sketch in self.sketches.values():
+            bins.merge(sketch.histogram)
+        used = [i for i, c in enumerate(bins.counts) if c]
+        summary.write(band_row, 0, "Price band", self.header_fmt)
+        for col, source in enumerate(sources, start=1):
+            summary.write(band_row, col, source, self.header_fmt)
+        for r, i in enumerate(used, start=band_row + 1):
+            summary.write(r, 0, f"{bins.edges[i]:,.0f}-{bins.edges[i + 1]:,.0f}")
+            for col, source in enumerate(sources, start=1):
+                summary.write_number(r, col, self.sketches[source].histogram.counts[i])
+        if used:
+            bands = self.workbook.add_chart({"type": "column", "subtype": "stacked"})
+            for col, source in enumerate(sources, start=1):
+                bands.add_series({
+                    "name": ["Summary", band_row, col],
+                    "categories": ["Summary", band_row + 1, 0, band_row + len(used), 0],
+                    "values": ["Summary", band_row + 1, col, band_row + len(used), col],
+                })
+            bands.set_title({"name": "Items per price band"})
+            summary.insert_chart(last + 3, 9, bands, {"x_scale": 1.6, "y_scale": 1.3})
+
+    def close(self):
+        self._write_summary()
+        self.workbook.close()
+        logging.info(f"Excel report saved to {self.path}")
+
+
+def csv_to_xlsx(csv_path: str, xlsx_path: str, currency: str = "usd", chunk: int = 1000):
+    # Converts a scrape/batch CSV without loading it into memory
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        writer = ExcelReportWriter(xlsx_path, currency, columns=list(reader.fieldnames or []))
+        batch: List[Dict] = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= chunk:
+                writer.add_items(batch)
+                batch = []
+        writer.add_items(batch)
+        writer.close()
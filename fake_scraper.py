@@ -0,0 +1,118 @@
+# fake_scraper.py
+# Stand-in for the browser pool that makes up results pages instead of
+# loading them, for load tests (loadtest.py). Enabled with
+# SCRAPER_BACKEND=fake; pages go through the real parse pool, pagination,
+# block detection and price conversion, only the page load is simulated.
+import os
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from pagination import SITE_PAGINATION
+
+# ------------------ Setup ------------------
+FAKE_LATENCY_MS = float(os.environ.get("FAKE_LATENCY_MS", 800))         # mean page load time
+FAKE_LATENCY_JITTER_MS = float(os.environ.get("FAKE_LATENCY_JITTER_MS", 300))
+FAKE_ITEMS_PER_PAGE = int(os.environ.get("FAKE_ITEMS_PER_PAGE", 48))
+FAKE_TOTAL_RESULTS = int(os.environ.get("FAKE_TOTAL_RESULTS", 1000))    # drives the early stop
+FAKE_ERROR_RATE = float(os.environ.get("FAKE_ERROR_RATE", 0.0))         # page loads that raise
+FAKE_BLOCK_RATE = float(os.environ.get("FAKE_BLOCK_RATE", 0.0))         # pages answered with a 503
+FAKE_WORKERS = int(os.environ.get("FAKE_WORKERS", os.environ.get("BROWSER_WORKERS", 2)))
+
+# Rates relative to usd, enough for every code convert_price knows about
+FAKE_USD_RATES = {"usd": 1.0, "eur": 0.92, "gbp": 0.79, "jpy": 151.0, "krw": 1350.0,
+                  "inr": 83.0, "rub": 92.0, "php": 56.0, "brl": 5.0, "btc": 0.000016}
+
+
+def fake_rates(code: str) -> dict:
+    # Same shape as the currency API: {code: {other: rate}}
+    base = FAKE_USD_RATES.get(code, 1.0)
+    return {code: {other: rate / base for other, rate in FAKE_USD_RATES.items()}}
+
+# ------------------ Pages ------------------
+
+def _amazon_page(query: str, page: int, items: list, total: int) -> str:
+    cards = "".join(
+        f'<div class="a-section a-spacing-small"><h2 class="a-size-mini">'
+        f'<a href="/dp/{item_id}?ref=sr_{page}"><span>{name}</span></a></h2>'
+        f'<span class="a-price"><span class="a-offscreen">${price:,.2f}</span></span></div>'
+        for item_id, name, price in items
+    )
+    first = (page - 1) * FAKE_ITEMS_PER_PAGE + 1
+    return (f'<html><body><span>{first}-{first + len(items) - 1} of over {total:,} results for "{query}"</span>'
+            f'<div class="s-search-results">{cards}</div></body></html>')
+
+
+def _ebay_page(query: str, page: int, items: list, total: int) -> str:
+    cards = "".join(
+        f'<li class="s-item"><a class="s-item__link" href="https://www.ebay.com/itm/{item_id}?hash={page}">'
+        f'<div class="s-item__title">{name}</div></a><span class="s-item__price">${price:,.2f}</span></li>'
+        for item_id, name, price in items
+    )
+    return (f'<html><body><h1 class="srp-controls__count-heading"><span class="BOLD">{total:,}</span> '
+            f'results for {query}</h1><ul class="srp-results">{cards}</ul></body></html>')
+
+
+PAGE_BUILDERS = {"amazon": _amazon_page, "ebay": _ebay_page}
+# Shaped like real ASINs and eBay item ids, so pagination.link_key parses them
+FAKE_ITEM_IDS = {"amazon": "B{page:04d}{i:05d}", "ebay": "9{page:05d}{i:06d}"}
+
+
+def fake_page(url: str, site: str) -> bytes:
+    # Deterministic per URL, so repeated queries see the same items
+    params = parse_qs(urlsplit(url).query)
+    query = (params.get("k") or params.get("_nkw") or ["item"])[0]
+    page_param = SITE_PAGINATION[site].page_param if site in SITE_PAGINATION else "page"
+    page = int((params.get(page_param) or ["1"])[0])
+    rng = random.Random(hashlib.sha256(url.encode()).digest())
+    remaining = max(0, FAKE_TOTAL_RESULTS - (page - 1) * FAKE_ITEMS_PER_PAGE)
+    items = [
+        (FAKE_ITEM_IDS.get(site, FAKE_ITEM_IDS["ebay"]).format(page=page, i=i),
+         f"{query.title()} model {rng.randint(100, 999)}",
+         round(rng.lognormvariate(3.5, 0.8), 2))
+        for i in range(min(FAKE_ITEMS_PER_PAGE, remaining))
+    ]
+    builder = PAGE_BUILDERS.get(site, _ebay_page)
+    return builder(query, page, items, FAKE_TOTAL_RESULTS).encode("utf-8")
+
+# ------------------ Pool ------------------
+
+class FakeBrowserPool:
+    # Same interface as BrowserPool, and the same bounded number of page
+    # loads in flight, so queueing in front of the browsers shows up in tests.
+
+    def __init__(self, workers: int = FAKE_WORKERS):
+        self.workers = workers
+        self.loads = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fake-browser")
+        self._lock = threading.Lock()
+
+    def _load(self, url: str, site: str, timeout_ms: Optional[float]) -> Tuple[Optional[int], bytes]:
+        delay = max(0.0, random.gauss(FAKE_LATENCY_MS, FAKE_LATENCY_JITTER_MS)) / 1000
+        if timeout_ms is not None and delay * 1000 > timeout_ms:
+            time.sleep(timeout_ms / 1000)
+            raise TimeoutError(f"Timeout {timeout_ms:.0f}ms exceeded loading {url}")
+        time.sleep(delay)
+        with self._lock:
+            self.loads += 1
+        roll = random.random()
+        if roll < FAKE_ERROR_RATE:
+            raise RuntimeError(f"Simulated page load failure for {url}")
+        if roll < FAKE_ERROR_RATE + FAKE_BLOCK_RATE:
+            return 503, b"<html><body>Service Unavailable</body></html>"
+        return 200, fake_page(url, site)
+
+    def submit(self, url: str, site: str, wait_until: str = "load", timeout_ms: Optional[float] = None) -> Future:
+        return self._executor.submit(self._load, url, site, timeout_ms)
+
+    def fetch(self, url: str, site: str, wait_until: str = "load", timeout_ms: Optional[float] = None) -> Tuple[Optional[int], bytes]:
+        return self.submit(url, site, wait_until, timeout_ms).result()
+
+    def rotate(self, site: str, discard: bool = True):
+        pass
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,227 @@
+# http_client.py
+# One pooled requests.Session for every non-browser fetch (exchange rates,
+# plain HTML pages). Connections are kept alive per host, responses are
+# decompressed transparently, GETs are retried with backoff (never past the
+# caller's deadline), and responses with an ETag / Last-Modified are revalidated with
+# conditional GETs instead of being downloaded again.
+# requests speaks HTTP/1.1 only; keep-alive is what removes the repeated
+# TLS handshakes here.
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util import make_headers
+from deadline import Deadline
+
+# ------------------ Setup ------------------
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", 10))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF_SECONDS = float(os.environ.get("HTTP_BACKOFF_SECONDS", 0.5))      # doubles per retry
+HTTP_MAX_RETRY_WAIT_SECONDS = float(os.environ.get("HTTP_MAX_RETRY_WAIT_SECONDS", 30))  # caps Retry-After
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", 16))       # hosts with their own pool
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))         # keep-alive connections per host
+HTTP_CACHE_ENTRIES = int(os.environ.get("HTTP_CACHE_ENTRIES", 256))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("HTTP_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+HTTP_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+USER_AGENT = "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:91.0) Gecko/20100101 Firefox/91.0"
+# "gzip,deflate", plus "br" when a brotli package is installed for urllib3 to decode it
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CachedResponse:
+    # What is needed to revalidate a URL and rebuild its response on a 304
+
+    def __init__(self, response: requests.Response):
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        self.headers = dict(response.headers)
+        self.content = response.content
+        self.encoding = response.encoding
+        self.fresh_until = time.time() + _max_age(response.headers.get("Cache-Control", ""))
+
+    def to_response(self, url: str) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.encoding = self.encoding
+        response._content = self.content
+        response.from_cache = True
+        return response
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _max_age(cache_control: str) -> float:
+    directives = [d.strip().lower() for d in cache_control.split(",")]
+    if "no-cache" in directives or "no-store" in directives:
+        return 0.0
+    for d in directives:
+        if d.startswith("max-age="):
+            try:
+                return float(d.split("=", 1)[1])
+            except ValueError:
+                return 0.0
+    return 0.0
+
+
+class HttpClient:
+
+    def __init__(self):
+        self.session = requests.Session()
+        # Retries happen in _send(), where they can be checked against a deadline
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING})
+        self._cache: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._cache_bytes = 0
+        self._counters = {"requests": 0, "retries": 0, "fresh_hits": 0, "not_modified": 0, "downloaded_bytes": 0}
+        self._lock = threading.Lock()
+
+    # ------------------ Cache ------------------
+
+    def _cached(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                self._cache.move_to_end(url)
+            return entry
+
+    def _store(self, url: str, response: requests.Response):
+        if response.status_code != 200 or not (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            return
+        if "no-store" in response.headers.get("Cache-Control", "").lower():
+            return
+        if len(response.content) > HTTP_CACHE_MAX_ENTRY_BYTES:
+            return
+        entry = CachedResponse(response)
+        with self._lock:
+            old = self._cache.pop(url, None)
+            if old is not None:
+                self._cache_bytes -= len(old.content)
+            self._cache[url] = entry
+            self._cache_bytes += len(entry.content)
+            while self._cache and (len(self._cache) > HTTP_CACHE_ENTRIES or self._cache_bytes > HTTP_CACHE_MAX_BYTES):
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted.content)
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._counters[key] += n
+
+    # ------------------ Requests ------------------
+
+    def _wait_to_retry(self, attempt: int, response: Optional[requests.Response],
+                       deadline: Optional[Deadline]) -> bool:
+        # Sleeps before the next attempt; False when the deadline can't fit one
+        delay = HTTP_BACKOFF_SECONDS * 2 ** attempt
+        if response is not None:
+            delay = max(delay, _retry_after(response.headers.get("Retry-After")) or 0.0)
+        delay = min(delay, HTTP_MAX_RETRY_WAIT_SECONDS)
+        if deadline is not None and delay >= deadline.remaining():
+            return False
+        self._count("retries")
+        time.sleep(delay)
+        return True
+
+    def _send(self, url: str, headers: Dict, timeout: float, deadline: Optional[Deadline],
+              stream: bool = False, allow_redirects: bool = True) -> requests.Response:
+        # timeout bounds each attempt's read (connects give up sooner); with a
+        # deadline, no attempt or backoff runs past it
+        for attempt in range(HTTP_RETRIES + 1):
+            read_timeout = timeout if deadline is None else deadline.timeout(timeout)
+            if read_timeout <= 0:
+                raise requests.Timeout(f"Deadline reached before fetching {url}")
+            last = attempt == HTTP_RETRIES
+            self._count("requests")
+            try:
+                response = self.session.get(url, headers=headers, stream=stream, allow_redirects=allow_redirects,
+                                            timeout=(min(HTTP_CONNECT_TIMEOUT_SECONDS, read_timeout), read_timeout))
+            except (requests.ConnectionError, requests.Timeout):
+                if last or not self._wait_to_retry(attempt, None, deadline):
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUSES or last or not self._wait_to_retry(attempt, response, deadline):
+                return response
+            response.close()
+
+    def get(self, url: str, headers: Optional[Dict] = None, timeout: Optional[float] = None,
+            conditional: bool = True, deadline: Optional[Deadline] = None,
+            stream: bool = False, allow_redirects: bool = True) -> requests.Response:
+        # stream=True leaves the body unread (and uncached); close the response when done
+        read_timeout = HTTP_TIMEOUT_SECONDS if timeout is None else timeout
+        request_headers = dict(headers or {})
+        conditional = conditional and not stream
+        entry = self._cached(url) if conditional else None
+        if entry is not None:
+            if time.time() < entry.fresh_until:
+                self._count("fresh_hits")
+                return entry.to_response(url)
+            if entry.etag:
+                request_headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                request_headers["If-Modified-Since"] = entry.last_modified
+
+        response = self._send(url, request_headers, read_timeout, deadline, stream, allow_redirects)
+        if stream:
+            return response
+        if response.status_code == 304 and entry is not None:
+            self._count("not_modified")
+            entry.fresh_until = time.time() + _max_age(response.headers.get("Cache-Control", ""))
+            return entry.to_response(url)
+        self._count("downloaded_bytes", len(response.content))
+        if conditional:
+            self._store(url, response)
+        return response
+
+    def get_json(self, url: str, **kwargs):
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def get_text(self, url: str, **kwargs) -> str:
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+        return response.text
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._counters, "cached_urls": len(self._cache), "cached_bytes": self._cache_bytes}
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+            logging.info(f"HTTP client ready (pool {HTTP_POOL_HOSTS}x{HTTP_POOL_SIZE}, accept-encoding {ACCEPT_ENCODING})")
+        return _client
@@ -0,0 +1,371 @@
+# loadtest.py
+# Load test for /scrape/. Starts the app with the fake scraper backend
+# (fake_scraper.py) and drives it with a fixed number of concurrent users or
+# a Poisson arrival rate:
+#   python loadtest.py --concurrency 8 --duration 60
+#   python loadtest.py --rate 2 --duration 120 --latency-ms 1500 --fields counts,graph
+#   python loadtest.py --url http://staging:8000 --concurrency 4
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MEMORY_SAMPLE_SECONDS = 0.2
+SERVER_START_TIMEOUT = 60
+
+# ------------------ Server ------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir: str) -> subprocess.Popen:
+    # The app writes scraped_data.csv etc. to its cwd, so it runs in a scratch dir
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")])),
+        "SCRAPER_BACKEND": "fake",
+        "FAKE_LATENCY_MS": str(args.latency_ms),
+        "FAKE_LATENCY_JITTER_MS": str(args.jitter_ms),
+        "FAKE_ITEMS_PER_PAGE": str(args.items),
+        "FAKE_TOTAL_RESULTS": str(args.total_results),
+        "FAKE_ERROR_RATE": str(args.error_rate),
+        "FAKE_BLOCK_RATE": str(args.block_rate),
+        "SITE_MIN_INTERVAL_SECONDS": str(args.min_interval),
+        "TRUSTED_PROXIES": "127.0.0.1",  # so --clients' X-Client-Id values count
+    })
+    if args.browser_workers:
+        env["BROWSER_WORKERS"] = env["FAKE_WORKERS"] = str(args.browser_workers)
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    cmd = [sys.executable, "-m", "uvicorn", "app_fastapi:app", "--host", "127.0.0.1",
+           "--port", str(args.port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_up(base_url: str, server: Optional[subprocess.Popen]):
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if requests.get(f"{base_url}/metrics", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Server at {base_url} did not come up in {SERVER_START_TIMEOUT}s")
+
+# ------------------ Memory ------------------
+
+def _status_kb(pid: int, field: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _process_tree(root: int) -> List[int]:
+    # root plus its descendants (parse pool workers)
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [root]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, []))
+    return tree
+
+
+class MemorySampler(threading.Thread):
+    # Linux only: the server's own high-water mark (VmHWM) comes from the
+    # kernel; the whole process tree is sampled since workers come and go.
+
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.tree_peak_kb = 0
+        self.server_peak_kb = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.sample()
+            self._done.wait(MEMORY_SAMPLE_SECONDS)
+
+    def sample(self):
+        rss = sum(_status_kb(pid, "VmRSS") for pid in _process_tree(self.pid))
+        self.tree_peak_kb = max(self.tree_peak_kb, rss)
+        self.server_peak_kb = max(self.server_peak_kb, _status_kb(self.pid, "VmHWM"))
+
+    def stop(self) -> Dict:
+        self._done.set()
+        self.join()
+        self.sample()
+        return {"server_peak_rss_mb": round(self.server_peak_kb / 1024, 1),
+                "process_tree_peak_rss_mb": round(self.tree_peak_kb / 1024, 1)}
+
+# ------------------ Load ------------------
+
+class Recorder:
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.samples: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, started: float, latency: float, outcome: str, items: Optional[int] = None):
+        if started < self.warmup_until:
+            return
+        with self._lock:
+            self.samples.append({"started": started, "latency": latency, "outcome": outcome, "items": items})
+
+
+def make_payload(args, n: int) -> Dict:
+    # Cycling through distinct queries keeps any per-query caching honest
+    return {
+        "search_field": f"{args.query_prefix} {n % args.distinct_queries}",
+        "currency": args.currency,
+        "pages": args.pages,
+        "fields": args.fields,
+    }
+
+
+def send(session: requests.Session, base_url: str, args, n: int, scheduled: float, recorder: Recorder):
+    # Latency counts from the scheduled start, so time spent waiting for a
+    # free client slot in open-loop mode is not hidden (coordinated omission).
+    try:
+        response = session.post(f"{base_url}/scrape/", json=make_payload(args, n), timeout=args.timeout,
+                                headers={"X-Client-Id": f"loadtest-{n % args.clients}"})
+        latency = time.time() - scheduled
+        if response.status_code != 200:
+            recorder.add(scheduled, latency, f"HTTP {response.status_code}")
+            return
+        body = response.json()
+        outcome = "ok" if "error" not in body else "app error"
+        recorder.add(scheduled, latency, outcome, body.get("items_found"))
+    except requests.RequestException as e:
+        recorder.add(scheduled, time.time() - scheduled, type(e).__name__)
+
+
+_sessions = threading.local()
+
+
+def thread_session() -> requests.Session:
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+
+def run_closed_loop(base_url: str, args, recorder: Recorder, stop_at: float):
+    # Each user sends its next request as soon as the previous one returns
+    counter = iter(range(args.requests or sys.maxsize))
+    lock = threading.Lock()
+
+    def user():
+        while time.time() < stop_at:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            send(thread_session(), base_url, args, n, time.time(), recorder)
+
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open_loop(base_url: str, args, recorder: Recorder, stop_at: float):
+    # Requests arrive on a Poisson schedule whatever the server's speed
+    rng = random.Random(0)
+    with ThreadPoolExecutor(max_workers=args.max_inflight) as executor:
+        scheduled = time.time()
+        n = 0
+        while scheduled < stop_at and (not args.requests or n < args.requests):
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(lambda n=n, s=scheduled: send(thread_session(), base_url, args, n, s, recorder))
+            n += 1
+            scheduled += rng.expovariate(args.rate)
+
+# ------------------ Report ------------------
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[Dict], elapsed: float) -> Dict:
+    ok = sorted(s["latency"] for s in samples if s["outcome"] == "ok")
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if s["outcome"] != "ok":
+            errors[s["outcome"]] = errors.get(s["outcome"], 0) + 1
+    items = [s["items"] for s in samples if s["items"] is not None]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else None,
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        "latency_seconds": {
+            "mean": round(sum(ok) / len(ok), 3) if ok else None,
+            **{f"p{p}": round(percentile(ok, p), 3) if ok else None for p in (50, 95, 99)},
+            "max": round(ok[-1], 3) if ok else None,
+        },
+        "items_per_response": round(sum(items) / len(items), 1) if items else None,
+    }
+
+
+def print_report(report: Dict):
+    r = report["results"]
+    lat = r["latency_seconds"]
+    print(f"\n{'-=' * 35}")
+    print(f"mode          {report['mode']}")
+    print(f"requests      {r['requests']} ({r['ok']} ok) in {report['measured_seconds']}s")
+    print(f"throughput    {r['throughput_rps']} req/s")
+    print(f"latency       mean {lat['mean']}s  p50 {lat['p50']}s  p95 {lat['p95']}s  p99 {lat['p99']}s  max {lat['max']}s")
+    print(f"error rate    {r['error_rate']}  {r['errors'] or ''}")
+    if report.get("memory"):
+        m = report["memory"]
+        print(f"peak memory   server {m['server_peak_rss_mb']} MB, with workers {m['process_tree_peak_rss_mb']} MB")
+    print(f"{'-=' * 35}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /scrape/ with a fake scraper backend")
+    target = parser.add_argument_group("target")
+    target.add_argument("--url", help="test a running instance instead of starting one")
+    target.add_argument("--pid", type=int, help="with --url: server pid to read memory from")
+    target.add_argument("--port", type=int, default=0, help="port for the started server (default: any free one)")
+
+    load = parser.add_argument_group("load")
+    mode = load.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=4, help="closed loop: simultaneous users")
+    mode.add_argument("--rate", type=float, help="open loop: mean arrivals per second (Poisson)")
+    load.add_argument("--max-inflight", type=int, default=256, help="open loop: client-side cap on open requests")
+    load.add_argument("--duration", type=float, default=30, help="seconds of load, after the warmup")
+    load.add_argument("--warmup", type=float, default=5, help="seconds of load not counted in the results")
+    load.add_argument("--requests", type=int, default=0, help="stop after this many requests (0: no limit)")
+    load.add_argument("--timeout", type=float, default=300, help="per-request timeout in seconds")
+
+    body = parser.add_argument_group("request")
+    body.add_argument("--pages", type=int, default=1)
+    body.add_argument("--currency", default="usd")
+    body.add_argument("--fields", default="counts", type=lambda s: [f for f in s.split(",") if f])
+    body.add_argument("--query-prefix", default="load test item")
+    body.add_argument("--distinct-queries", type=int, default=50)
+    body.add_argument("--clients", type=int, default=1,
+                      help="spread requests over this many X-Client-Id values (with --url, the server "
+                           "must list this host in TRUSTED_PROXIES)")
+
+    fake = parser.add_argument_group("fake backend (started server only)")
+    fake.add_argument("--latency-ms", type=float, default=800, help="mean page load time")
+    fake.add_argument("--jitter-ms", type=float, default=300)
+    fake.add_argument("--items", type=int, default=48, help="items per page")
+    fake.add_argument("--total-results", type=int, default=1000)
+    fake.add_argument("--error-rate", type=float, default=0.0, help="share of page loads that fail")
+    fake.add_argument("--block-rate", type=float, default=0.0, help="share of page loads answered with a 503")
+    fake.add_argument("--browser-workers", type=int, help="page loads in flight (BROWSER_WORKERS)")
+    fake.add_argument("--min-interval", type=float, default=0.0,
+                      help="SITE_MIN_INTERVAL_SECONDS; 0 so the politeness delay does not cap the test")
+
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    server = None
+    workdir = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        pid = args.pid
+    else:
+        workdir = tempfile.mkdtemp(prefix="loadtest-")
+        args.port = args.port or free_port()
+        server = start_server(args, workdir)
+        base_url = f"http://127.0.0.1:{args.port}"
+        pid = server.pid
+    sampler = None
+    try:
+        wait_until_up(base_url, server)
+        if pid and os.path.exists(f"/proc/{pid}/status"):
+            sampler = MemorySampler(pid)
+            sampler.start()
+
+        mode = f"open loop, {args.rate} req/s" if args.rate else f"closed loop, {args.concurrency} users"
+        logging.info(f"Load testing {base_url} ({mode}) for {args.warmup}s warmup + {args.duration}s")
+        started = time.time()
+        recorder = Recorder(warmup_until=started + args.warmup)
+        stop_at = started + args.warmup + args.duration
+        if args.rate:
+            run_open_loop(base_url, args, recorder, stop_at)
+        else:
+            run_closed_loop(base_url, args, recorder, stop_at)
+        measured = max(0.0, time.time() - recorder.warmup_until)
+
+        report = {
+            "mode": mode,
+            "target": base_url,
+            "measured_seconds": round(measured, 1),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("json", "url", "pid")},
+            "results": summarize(recorder.samples, measured),
+            "memory": sampler.stop() if sampler else None,
+        }
+        sampler = None
+        try:
+            report["server_metrics"] = requests.get(f"{base_url}/metrics", timeout=5).json()
+        except (requests.RequestException, ValueError):
+            pass
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            logging.info(f"Server log and output files kept in {workdir}")
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Report saved to {args.json}")
+    return 0 if report["results"]["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
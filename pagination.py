@@ -0,0 +1,144 @@
+# pagination.py
+import os
+import re
+import math
+import logging
+from typing import Optional
+from urllib.parse import unquote, urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class SitePagination:
+    # How one marketplace paginates its search results.
+
+    def __init__(self, site: str, page_param: str, default_page_size: int,
+                 page_size_param: Optional[str] = None, page_size: Optional[int] = None,
+                 count_pattern: Optional[str] = None, next_pattern: Optional[str] = None,
+                 next_disabled_pattern: Optional[str] = None):
+        self.site = site
+        self.page_param = page_param
+        self.default_page_size = default_page_size
+        self.page_size_param = page_size_param
+        self.page_size = page_size if page_size_param else None
+        self.count_re = re.compile(count_pattern, re.S) if count_pattern else None
+        self.next_re = re.compile(next_pattern) if next_pattern else None
+        self.next_disabled_re = re.compile(next_disabled_pattern) if next_disabled_pattern else None
+
+    @property
+    def items_per_page(self) -> int:
+        return self.page_size or self.default_page_size
+
+    def page_url(self, target_url: str, page: int) -> str:
+        scheme, netloc, path, query, fragment = urlsplit(target_url)
+        params = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+                  if k not in (self.page_param, self.page_size_param)]
+        params.append((self.page_param, str(page)))
+        if self.page_size:
+            params.append((self.page_size_param, str(self.page_size)))
+        return urlunsplit((scheme, netloc, path, urlencode(params), fragment))
+
+    def pages_for(self, requested_pages: int) -> int:
+        # Callers ask for pages of the site's default size; with a larger page
+        # size we can cover the same listings with fewer page loads.
+        return max(1, math.ceil(requested_pages * self.default_page_size / self.items_per_page))
+
+    def total_results(self, html: str) -> Optional[int]:
+        if not self.count_re:
+            return None
+        match = self.count_re.search(html)
+        if not match:
+            return None
+        return int(match.group(1).replace(",", "").replace(".", ""))
+
+    def has_next(self, html: str) -> Optional[bool]:
+        # None when the page gives no hint either way, so a markup change
+        # cannot cut every crawl short after page 1.
+        if self.next_disabled_re and self.next_disabled_re.search(html):
+            return False
+        if self.next_re and self.next_re.search(html):
+            return True
+        return None
+
+
+EBAY_ITEMS_PER_PAGE = os.environ.get("EBAY_ITEMS_PER_PAGE")  # 60, 120 or 240
+
+SITE_PAGINATION = {
+    "amazon": SitePagination(
+        "amazon", page_param="page", default_page_size=48,
+        count_pattern=r"of\s+(?:over\s+)?([\d,.]+)\s+results",
+        next_pattern=r'class="[^"]*s-pagination-next',
+        next_disabled_pattern=r'class="[^"]*s-pagination-next[^"]*s-pagination-disabled',
+    ),
+    "ebay": SitePagination(
+        "ebay", page_param="_pgn", default_page_size=60,
+        page_size_param="_ipg", page_size=int(EBAY_ITEMS_PER_PAGE) if EBAY_ITEMS_PER_PAGE else None,
+        count_pattern=r'srp-controls__count-heading.*?<span[^>]*class="BOLD"[^>]*>([\d,.]+)</span>',
+        next_pattern=r'class="[^"]*pagination__next',
+        next_disabled_pattern=r'class="[^"]*pagination__next[^"]*"[^>]*aria-disabled="true"',
+    ),
+}
+
+
+# Amazon ASINs (also inside the url= of /sspa/click sponsored links) and eBay item ids
+ITEM_ID_PATTERNS = {
+    "amazon": re.compile(r"/(?:dp|gp/product)/([A-Z0-9]{10})"),
+    "ebay": re.compile(r"/itm/(?:[^/?]+/)?(\d+)"),
+}
+
+
+def link_key(link: str) -> str:
+    # Links carry per-page tracking (/ref=sr_1_N, query parameters), so the
+    # item id identifies a listing; unknown shapes fall back to the full URL.
+    decoded = unquote(link)
+    for site, pattern in ITEM_ID_PATTERNS.items():
+        match = pattern.search(decoded)
+        if match:
+            return f"{site}:{match.group(1)}"
+    return link.rstrip("/")
+
+
+class PaginationPlan:
+    # Tracks one (site, query) crawl and decides when further pages stop paying off.
+
+    def __init__(self, site: str, target_url: str, requested_pages: int):
+        self.pagination = SITE_PAGINATION[site]
+        self.target_url = target_url
+        self.last_page = self.pagination.pages_for(requested_pages)
+        self.seen: set = set()
+        self.stopped_reason: Optional[str] = None
+
+    def url(self, page: int) -> str:
+        return self.pagination.page_url(self.target_url, page)
+
+    def pages(self):
+        page = 1
+        while page <= self.last_page and self.stopped_reason is None:
+            yield page
+            page += 1
+
+    def observe(self, page: int, html: bytes, rows: list) -> list:
+        # Returns the rows not seen on earlier pages and updates the plan.
+        text = html.decode("utf-8", errors="ignore") if isinstance(html, bytes) else html
+        if page == 1:
+            total = self.pagination.total_results(text)
+            if total is not None:
+                available = max(1, math.ceil(total / self.pagination.items_per_page))
+                if available < self.last_page:
+                    logging.info(f"{self.pagination.site}: {total} results, only {available} page(s) to fetch")
+                    self.last_page = available
+
+        fresh = []
+        for row in rows:
+            key = link_key(row[2])
+            if key not in self.seen:
+                self.seen.add(key)
+                fresh.append(row)
+
+        if not rows:
+            self.stopped_reason = "empty page"
+        elif not fresh:
+            self.stopped_reason = "all duplicates"
+        elif self.pagination.has_next(text) is False:
+            self.stopped_reason = "no next page"
+        if self.stopped_reason and page < self.last_page:
+            logging.info(f"{self.pagination.site}: stopping after page {page} ({self.stopped_reason})")
+        return fresh
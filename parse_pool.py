@@ -0,0 +1,165 @@
+# parse_pool.py
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable
+from bs4 import BeautifulSoup
+
+# ------------------ Setup ------------------
+# Number of parser processes; 0 parses in the calling process.
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 1))
+# "lxml" is noticeably faster when installed, "html.parser" always works.
+HTML_PARSER = os.environ.get("HTML_PARSER", "html.parser")
+# The pool starts lazily from a crawl thread while other threads run; forking
+# then could copy a lock some other thread holds (logging's, say) into the
+# workers. forkserver/spawn start them from a clean process instead.
+PARSE_START_METHOD = os.environ.get(
+    "PARSE_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Compact row produced by the extractors: (name, raw price text, link, image
+# URL or "" when the card has none)
+ItemTuple = tuple[str, str, str, str]
+
+# ------------------ Extractors ------------------
+# These mirror the Playwright selectors in app_fastapi.py, but run on raw HTML
+# so they can be executed in a worker process.
+
+def image_src(img) -> str:
+    # Lazy-loaded images keep the real URL in data-src; placeholders and
+    # inline data: URIs are not worth a thumbnail
+    if img is None:
+        return ""
+    for attr in ("data-src", "src"):
+        src = (img.get(attr) or "").strip()
+        if src.startswith("//"):
+            src = f"https:{src}"
+        if src.startswith("http") and not src.lower().split("?")[0].endswith(".gif"):
+            return src
+    return ""
+
+
+def extract_amazon(soup: BeautifulSoup) -> list[ItemTuple]:
+    rows: list[ItemTuple] = []
+    for item in soup.select('div.a-section.a-spacing-small'):
+        name_el = item.select_one('h2.a-size-mini > a > span')
+        price_el = item.select_one('span.a-price > span.a-offscreen')
+        link_el = item.select_one('h2.a-size-mini > a')
+        if not (name_el and price_el and link_el and link_el.get('href')):
+            continue  # Skip if any critical element is missing
+        # The product image sits next to the title block, inside the same result card
+        card = item.find_parent(attrs={'data-component-type': 's-search-result'}) or item
+        rows.append((
+            name_el.get_text(strip=True),
+            price_el.get_text(strip=True),
+            f"https://amazon.com{link_el['href']}",
+            image_src(card.select_one('img.s-image')),
+        ))
+    return rows
+
+
+def extract_ebay(soup: BeautifulSoup) -> list[ItemTuple]:
+    rows: list[ItemTuple] = []
+    for item in soup.select('li.s-item'):
+        title_el = item.select_one('div.s-item__title')
+        price_el = item.select_one('span.s-item__price')
+        link_el = item.select_one('a.s-item__link')
+        if not (title_el and price_el and link_el and link_el.get('href')):
+            continue
+        title = title_el.get_text(strip=True)
+        if title == 'Shop on eBay':
+            continue  # Placeholder card, not a product
+        image = image_src(item.select_one('.s-item__image img') or item.select_one('img'))
+        rows.append((title, price_el.get_text(" ", strip=True), link_el['href'], image))
+    return rows
+
+
+EXTRACTORS: dict[str, Callable[[BeautifulSoup], list[ItemTuple]]] = {
+    "amazon": extract_amazon,
+    "ebay": extract_ebay,
+}
+
+
+def parse_html_bytes(html: bytes | str, site: str) -> list[ItemTuple]:
+    extractor = EXTRACTORS.get(site)
+    if extractor is None:
+        logging.warning(f"No parsing logic for site '{site}'")
+        return []
+    soup = BeautifulSoup(html, HTML_PARSER)
+    return extractor(soup)
+
+# ------------------ Pool ------------------
+
+class ParsePool:
+    def __init__(self, workers: int | None = None):
+        self.workers = PARSE_WORKERS if workers is None else workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor | None:
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context(PARSE_START_METHOD))
+                except (OSError, NotImplementedError, ValueError) as e:
+                    logging.warning(f"Process pool unavailable, parsing in-process: {e}")
+                    self.workers = 0
+            return self._executor
+
+    def _reset(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def submit(self, html: bytes | str, site: str) -> Future:
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                return executor.submit(parse_html_bytes, html, site)
+            except (BrokenProcessPool, RuntimeError) as e:
+                logging.warning(f"Parse pool broken, falling back to in-process: {e}")
+                self._reset()
+        future: Future = Future()
+        try:
+            future.set_result(parse_html_bytes(html, site))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def result(self, future: Future, html: bytes | str, site: str) -> list[ItemTuple]:
+        # A worker dying mid-parse should cost us one in-process parse, not the page.
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            logging.warning(f"Parse worker died, re-parsing in-process: {e}")
+            self._reset()
+            return parse_html_bytes(html, site)
+
+    def parse(self, html: bytes | str, site: str) -> list[ItemTuple]:
+        return self.result(self.submit(html, site), html, site)
+
+    def parse_many(self, pages: Iterable[tuple[bytes | str, str]]) -> list[list[ItemTuple]]:
+        pages = list(pages)
+        futures = [self.submit(html, site) for html, site in pages]
+        return [self.result(f, html, site) for f, (html, site) in zip(futures, pages)]
+
+    def shutdown(self):
+        self._reset()
+
+
+_pool: ParsePool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ParsePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ParsePool()
+        return _pool
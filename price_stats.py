@@ -0,0 +1,300 @@
+# price_stats.py
+# Mergeable price sketches: everything here can be updated one price at a
+# time and merged across pages, sources or worker processes, in memory that
+# does not grow with the number of items.
+import math
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+# Log-spaced bins from 1 cent to 1M cover any marketplace price
+HISTOGRAM_BINS = 48
+HISTOGRAM_MIN = 0.01
+HISTOGRAM_MAX = 1_000_000.0
+
+
+class RunningMoments:
+    # Welford's online mean/variance; merge() uses Chan et al.'s parallel formula.
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def merge(self, other: "RunningMoments"):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "RunningMoments":
+        m = cls()
+        m.count, m.mean, m.m2, m.min, m.max = d["count"], d["mean"], d["m2"], d["min"], d["max"]
+        return m
+
+
+class TDigest:
+    # Merging t-digest (Dunning). Centroids are kept sorted; incoming points are
+    # buffered and folded in using the k1 scale function, which keeps the
+    # tails (cheapest / most expensive offers) accurate.
+
+    def __init__(self, compression: float = 100.0):
+        self.compression = compression
+        self.means: list[float] = []
+        self.weights: list[float] = []
+        self.total = 0.0
+        self._buffer: list[tuple[float, float]] = []
+
+    def add(self, x: float, w: float = 1.0):
+        self._buffer.append((x, w))
+        if len(self._buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other: "TDigest"):
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self._compress()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        total = sum(w for _, w in points)
+        means: list[float] = []
+        weights: list[float] = []
+        cur_mean, cur_weight = points[0]
+        seen = 0.0
+        k_lower = self._k(0.0)
+        for x, w in points[1:]:
+            if self._k((seen + cur_weight + w) / total) - k_lower <= 1.0:
+                cur_weight += w
+                cur_mean += (x - cur_mean) * w / cur_weight
+            else:
+                means.append(cur_mean)
+                weights.append(cur_weight)
+                seen += cur_weight
+                k_lower = self._k(seen / total)
+                cur_mean, cur_weight = x, w
+        means.append(cur_mean)
+        weights.append(cur_weight)
+        self.means, self.weights, self.total = means, weights, total
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        # Interpolate between centroid centers, each sitting at the middle of its weight
+        target = q * self.total
+        cumulative = 0.0
+        centers = []
+        for w in self.weights:
+            centers.append(cumulative + w / 2)
+            cumulative += w
+        i = bisect.bisect_left(centers, target)
+        if i == 0:
+            return self.means[0]
+        if i == len(centers):
+            return self.means[-1]
+        lo, hi = centers[i - 1], centers[i]
+        frac = (target - lo) / (hi - lo) if hi > lo else 0.0
+        return self.means[i - 1] + frac * (self.means[i] - self.means[i - 1])
+
+    def to_dict(self) -> dict:
+        self._compress()
+        return {"compression": self.compression, "means": self.means, "weights": self.weights}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "TDigest":
+        t = cls(d["compression"])
+        t._buffer = list(zip(d["means"], d["weights"]))
+        t._compress()
+        return t
+
+
+class FixedHistogram:
+    # Log-spaced bins so cheap accessories and expensive devices both get resolution.
+
+    def __init__(self, bins: int = HISTOGRAM_BINS, lo: float = HISTOGRAM_MIN, hi: float = HISTOGRAM_MAX):
+        self.lo, self.hi = lo, hi
+        self.edges = [lo * (hi / lo) ** (i / bins) for i in range(bins + 1)]
+        self.counts = [0] * bins
+
+    def add(self, x: float):
+        i = bisect.bisect_right(self.edges, x) - 1
+        self.counts[min(max(i, 0), len(self.counts) - 1)] += 1
+
+    def merge(self, other: "FixedHistogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def nonempty_bins(self) -> list[dict]:
+        return [
+            {"low": round(self.edges[i], 2), "high": round(self.edges[i + 1], 2), "count": c}
+            for i, c in enumerate(self.counts) if c
+        ]
+
+    def to_dict(self) -> dict:
+        return {"bins": len(self.counts), "lo": self.lo, "hi": self.hi, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "FixedHistogram":
+        h = cls(d["bins"], d["lo"], d["hi"])
+        h.counts = list(d["counts"])
+        return h
+
+
+class PriceSketch:
+    # Moments + t-digest + histogram, plus the single cheapest offer seen.
+
+    def __init__(self):
+        self.moments = RunningMoments()
+        self.digest = TDigest()
+        self.histogram = FixedHistogram()
+        self.cheapest: Optional[dict] = None
+
+    def add(self, price: float, item: Optional[dict] = None):
+        if not math.isfinite(price) or price <= 0:
+            return
+        self.moments.add(price)
+        self.digest.add(price)
+        self.histogram.add(price)
+        if item is not None and (self.cheapest is None or price < self.cheapest["price"]):
+            self.cheapest = {"price": price, "name": item.get("Name"), "link": item.get("Link")}
+
+    def merge(self, other: "PriceSketch"):
+        self.moments.merge(other.moments)
+        self.digest.merge(other.digest)
+        self.histogram.merge(other.histogram)
+        if other.cheapest and (self.cheapest is None or other.cheapest["price"] < self.cheapest["price"]):
+            self.cheapest = dict(other.cheapest)
+
+    def summary(self) -> dict:
+        m = self.moments
+        if m.count == 0:
+            return {"count": 0}
+        q = self.digest.quantile
+        return {
+            "count": m.count,
+            "mean": round(m.mean, 2),
+            "stddev": round(math.sqrt(m.variance), 2),
+            "min": round(m.min, 2),
+            "max": round(m.max, 2),
+            "median": round(q(0.5), 2),
+            "percentiles": {f"p{p}": round(q(p / 100), 2) for p in (5, 10, 25, 75, 90, 95)},
+            "histogram": self.histogram.nonempty_bins(),
+            "cheapest": self.cheapest,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "moments": self.moments.to_dict(),
+            "digest": self.digest.to_dict(),
+            "histogram": self.histogram.to_dict(),
+            "cheapest": self.cheapest,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "PriceSketch":
+        s = cls()
+        s.moments = RunningMoments.from_dict(d["moments"])
+        s.digest = TDigest.from_dict(d["digest"])
+        s.histogram = FixedHistogram.from_dict(d["histogram"])
+        s.cheapest = d.get("cheapest")
+        return s
+
+
+class QueryStats:
+    # One sketch per source for a query; the overall view is their merge.
+
+    def __init__(self):
+        self.sources: dict[str, PriceSketch] = {}
+        self._lock = threading.Lock()
+
+    def add_items(self, source: str, items: Iterable[dict]):
+        with self._lock:
+            sketch = self.sources.setdefault(source, PriceSketch())
+            for item in items:
+                try:
+                    price = float(str(item["Price"]).split()[-1])
+                except (KeyError, ValueError, IndexError):
+                    continue
+                sketch.add(price, item)
+
+    def merge(self, other: "QueryStats"):
+        with self._lock:
+            for source, sketch in other.sources.items():
+                self.sources.setdefault(source, PriceSketch()).merge(sketch)
+
+    def overall(self) -> PriceSketch:
+        total = PriceSketch()
+        with self._lock:
+            for sketch in self.sources.values():
+                total.merge(sketch)
+        return total
+
+    def summary(self) -> dict:
+        with self._lock:
+            per_source = {source: sketch.summary() for source, sketch in self.sources.items()}
+        return {
+            "overall": self.overall().summary(),
+            "sources": per_source,
+            "cheapest_per_source": {s: v.get("cheapest") for s, v in per_source.items()},
+        }
+
+
+# Stats are kept per (query, currency): prices in different currencies don't mix.
+# Least recently used queries are dropped past MAX_TRACKED_QUERIES.
+MAX_TRACKED_QUERIES = 1000
+_stats: "OrderedDict[tuple[str, str], QueryStats]" = OrderedDict()
+_stats_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def start_query_stats(query: str, currency: str) -> QueryStats:
+    # A new scrape replaces the previous run's numbers for the query; /stats
+    # sees the new sketch fill up page by page.
+    key = (normalize_query(query), currency)
+    stats = QueryStats()
+    with _stats_lock:
+        _stats[key] = stats
+        _stats.move_to_end(key)
+        while len(_stats) > MAX_TRACKED_QUERIES:
+            _stats.popitem(last=False)
+    return stats
+
+
+def find_query_stats(query: str, currency: str) -> Optional[QueryStats]:
+    with _stats_lock:
+        return _stats.get((normalize_query(query), currency))
@@ -1,24 +1,43 @@
+# products_webscrap.py
+# Batch scraper for cron / bulk runs, no API server needed:
+#   python products_webscrap.py "desk lamp" "usb c hub" --currency eur --pages 2
+#   python products_webscrap.py --file queries.txt --sites ebay --format parquet --out-dir nightly/
+import os
 import sys
 import csv
+import json
 import time
 import locale
 import logging
-import requests
+import argparse
+import threading
 import numpy as np
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.cluster import KMeans
-import matplotlib.pyplot as plt
-
+from parse_pool import get_parse_pool
+from pagination import PaginationPlan
+from crawler import browser_fetch, crawl, http_fetch
+from browser_pool import BROWSER_WORKERS, close_browser_pool
+from price_stats import QueryStats, normalize_query
+from http_client import get_http_client
+# Figures are built with the object API, not pyplot's global state, because
+# graphs are drawn from several worker threads at once
+from matplotlib.figure import Figure
+
+# Defaults for convert_price() without settings; main() passes explicit
+# settings to every query instead.
 remove_currency_from_csv: bool = True
+currency: str = 'usd'
+currency_symbol: str = '$'
+api_url_for_currencies: dict = {}
 locale.setlocale(locale.LC_ALL, '')
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
-api_all_currencies: dict = requests.get(
-    'https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies.json').json()
-# Define the user agent header for your requests
-headers: dict = {
-    'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:91.0) Gecko/20100101 Firefox/91.0'}
+CURRENCY_API = 'https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1'
+SEARCH_URLS: dict = {
+    'amazon': 'https://amazon.com/s?k={query}&s=exact-aware-popularity-rank',
+    'ebay': 'https://ebay.com/sch/i.html?_nkw={query}',
+}
 symbols_hash_map: dict = {
     '$': 'usd',
     '€': 'eur',
@@ -32,6 +51,26 @@ symbols_hash_map: dict = {
     '₿': 'btc'
 }  # supported currencies, used to convert from symbols to currency code and vice versa
 
+# Rates are fetched once per currency and shared by every query of the run
+_rates: dict = {}
+_rates_lock = threading.Lock()
+
+
+def get_rates(code: str) -> dict:
+    with _rates_lock:
+        if code not in _rates:
+            _rates[code] = get_http_client().get_json(f'{CURRENCY_API}/currencies/{code}.json')
+        return _rates[code]
+
+
+def currency_settings(code: str, remove_currency: bool = True) -> dict:
+    return {
+        'currency': code,
+        'symbol': [k for k, v in symbols_hash_map.items() if v == code][0],
+        'remove_currency': remove_currency,
+        'rates': get_rates(code),
+    }
+
 # def convert_price(price_data:str, source_url:str) -> str | None:
 #     original_symbol:str = ''.join([symbol for symbol in price_data if not symbol.isdigit() and symbol not in ('.', ',', 'a', 'to')])[:2]
 #     original_currency:str = symbols_hash_map[original_symbol]
@@ -54,7 +93,10 @@ symbols_hash_map: dict = {
 #             return f"{currency_symbol} {float(value_without_symbol if ',' not in value_without_symbol else value_without_symbol.replace(',', ''))/api_url_for_currencies[currency][original_currency]:.2f}"
 
 
-def convert_price(price_data: str, source_url: str) -> str:
+def convert_price(price_data: str, source_url: str, settings: dict | None = None) -> str:
+    if settings is None:
+        settings = {'currency': currency, 'symbol': currency_symbol,
+                    'remove_currency': remove_currency_from_csv, 'rates': api_url_for_currencies}
     try:
         price_data = price_data.replace(u'\xa0', ' ').strip()
         # Extract symbol, handling spaces
@@ -71,37 +113,13 @@ def convert_price(price_data: str, source_url: str) -> str:
             c for c in price_parts if c.isdigit() or c == '.')
         amount = float(numeric_part) if numeric_part else 0.0
         converted_amount = amount / \
-            api_url_for_currencies[currency][original_currency]
-        return f'{converted_amount:.2f}' if remove_currency_from_csv else f'{currency_symbol} {converted_amount:.2f}'
+            settings['rates'][settings['currency']][original_currency]
+        return f'{converted_amount:.2f}' if settings['remove_currency'] else f"{settings['symbol']} {converted_amount:.2f}"
     except Exception as e:
         logging.warning(f"Price conversion failed for '{price_data}': {e}")
         return '0.00'
 
 
-def parse_amazon(target_url) -> list[dict]:
-    data: list = []
-    with sync_playwright() as pw:
-        # Launch new browser
-        browser = pw.chromium.launch(headless=True)
-        page = browser.new_page()
-
-        # Go to Amazon URL and extract data
-        page.goto(target_url)
-        try:
-            items = page.query_selector_all('div.a-section.a-spacing-small')
-            for item in items:
-                if item.query_selector('h2.a-size-mini > a > span'):
-                    item_data = {
-                        'Name': item.query_selector('h2.a-size-mini > a > span').inner_text(),
-                        'Price': convert_price(item.query_selector('span.a-price > span.a-offscreen').inner_text(), 'amazon'),
-                        'Link': f'https://amazon.com{item.query_selector('h2.a-size-mini > a').get_attribute('href')}'
-                    }
-                    data.append(item_data)
-            browser.close()
-        except AttributeError as e:
-            logging.warning(f"Skipping item due to missing data: {e}")
-    return data
-
 # def parse_aliexpress(soup: BeautifulSoup) -> list[dict]:
 #     # check if the href url from the item has https at the begin
 #     def check_https(href_url:str) -> str:
@@ -124,64 +142,36 @@ def parse_amazon(target_url) -> list[dict]:
 #     return data
 
 
-def parse_ebay(soup: BeautifulSoup) -> list[dict]:
-    data: list = []
-    items = soup.find_all('li', class_='s-item s-item__pl-on-bottom')
-    for item in items:
-        # Check if it is a valid product with a valid price (price bigger than 0.00)
-        if item.find('div', class_='s-item__title').text.strip() != 'Shop on eBay':
-            try:
-                item_data = {
-                    'Name': item.find('div', class_='s-item__title').text.strip(),
-                    'Price': convert_price(item.find('span', class_='s-item__price').text.strip(), 'ebay'),
-                    'Link': item.find('a', href=True)['href']
-                }
-                data.append(item_data)
-            except AttributeError as e:
-                logging.warning(f"Skipping item due to missing data: {e}")
+def rows_to_items(rows: list[tuple], source: str, settings: dict | None = None) -> list[dict]:
+    data = []
+    for name, price_text, link, image in rows:
+        price = convert_price(price_text, source, settings)
+        if price == '0.00':
+            continue  # Skip malformed price
+        data.append({'Name': name, 'Price': price, 'Link': link, 'Image': image})
     return data
 
 
-def parse_html(html: str | bytes, target_url: str) -> list[dict]:
-    soup = BeautifulSoup(html, 'html.parser')
-    if 'aliexpress' in target_url:
-        return parse_aliexpress(soup)
-    elif 'ebay' in target_url:
-        return parse_ebay(soup)
-    else:
-        logging.warning(f"No parsing logic for {target_url}")
-        return []
-
-# Fetch the HTML content of a webpage
-
+# Orchestrate the scraping of one site for one query
 
-def fetch_html(url: str | bytes, headers: dict | None = None) -> str | None:
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Check for HTTP errors
-        return response.text
-    except requests.RequestException as e:
-        logging.error(f"Error fetching {url}: {e}")
-        return None
 
-# Orchestrate the scraping
+def scrape_site(site: str, query: str, pages: int = 1, settings: dict | None = None,
+                report: dict | None = None) -> list[dict]:
+    # Same crawl as the API (crawler.py): early stop, block detection and the
+    # per-site politeness delay, shared with every other query in this process.
+    report = report if report is not None else {}
+    plan = PaginationPlan(site, SEARCH_URLS[site].format(query=query), pages)
+    # eBay serves its results without JavaScript
+    fetch = http_fetch if site == 'ebay' else browser_fetch
+    all_data: list = []
 
+    def on_page(entry):
+        page, _, rows = entry
+        data = rows_to_items(rows, site, settings)
+        all_data.extend(data)
+        logging.info(f"Page {page} scraped successfully, {len(data)} items found.")
 
-def scrape_website(target_url: str, headers: dict | None = None, pages: int = 1, sleep_time: int = 1) -> list:
-    all_data: list = []
-    for page in range(1, pages + 1):
-        url = f"{target_url}&page={page}"
-        logging.info(f"Scraping {url}")
-        if url.startswith('https://amazon'):
-            all_data.extend(parse_amazon(url))
-        else:
-            html = fetch_html(url, headers)
-            if html:
-                data = parse_html(html, target_url)
-                all_data.extend(data)
-                logging.info(
-                    f"Page {page} scraped successfully, {len(data)} items found.")
-        time.sleep(sleep_time)
+    report.update(crawl(site, plan, fetch, on_page=on_page))
     return all_data
 
 
@@ -208,6 +198,17 @@ def save_to_csv(data: list[dict], filename: str = 'output.csv'):
 
     logging.info(f"Data saved to {filename}")
 
+
+def save_to_parquet(data: list[dict], filename: str = 'output.parquet'):
+    # pyarrow is only needed for --format parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if not data:
+        logging.warning("No data to save.")
+        return
+    pq.write_table(pa.Table.from_pylist(data), filename)
+    logging.info(f"Data saved to {filename}")
+
 # def pie_graph(data:list[dict], filename:str):
 #     if not data:
 #         logging.warning("No data to create a pie graph.")
@@ -245,27 +246,26 @@ def save_to_csv(data: list[dict], filename: str = 'output.csv'):
     # return
 
 
-def pie_graph(data: list[dict], filename: str):
+def pie_graph(data: list[dict], filename: str, title: str, settings: dict):
     if not data:
         logging.warning("No data to create a pie graph.")
         return
 
     logging.info("Making a pie graph from the data scraped...")
-    names = []
+    symbol = settings['symbol']
     prices = []
     for item in data:
-        if ',' in item['Price']:
-            for value in item['Price'].replace(currency_symbol, '').split(', '):
-                names.append(item['Name'])
+        for value in item['Price'].replace(symbol, '').split(', '):
+            if float(value) > 0:
                 prices.append(float(value))
-        else:
-            names.append(item['Name'])
-            prices.append(float(item['Price'].replace(currency_symbol, '')))
+    if not prices:
+        logging.warning("No prices to create a pie graph.")
+        return
 
     # Convert to 2D NumPy array for KMeans
     # Ensure 2D shape: [[139.], [169.], ...]
     numpy_prices = np.array(prices).reshape(-1, 1)
-    kmeans = KMeans(n_clusters=5, random_state=0).fit(
+    kmeans = KMeans(n_clusters=min(5, len(prices)), random_state=0).fit(
         numpy_prices)  # Fit on 2D array
     labels = kmeans.predict(numpy_prices)
     unique_labels, counts = np.unique(labels, return_counts=True)
@@ -276,76 +276,144 @@ def pie_graph(data: list[dict], filename: str):
     ]
 
     labels = [
-        f'Around {currency_symbol}{price_min}-{price_max}' for price_min, price_max in price_ranges]
-    plt.figure(figsize=(12, 9), facecolor='black')
-    plt.pie(counts, labels=None, autopct='%1.1f%%', startangle=140, textprops={
-            'color': 'black', 'fontsize': 16}, wedgeprops={'edgecolor': 'black'})
-    plt.title(
-        f'Distribution of prices (in {currency}) for {search_field} (using K-Means)', color='white', size=22)
-    plt.legend(bbox_to_anchor=(1.2, 1), labels=labels, loc='upper right', fontsize='x-large',
-               labelcolor='white', frameon=True, edgecolor='white', facecolor='none')
-    plt.tight_layout()
-    plt.savefig(filename)
+        f'Around {symbol}{price_min}-{price_max}' for price_min, price_max in price_ranges]
+    fig = Figure(figsize=(12, 9), facecolor='black')
+    ax = fig.subplots()
+    ax.pie(counts, labels=None, autopct='%1.1f%%', startangle=140, textprops={
+           'color': 'black', 'fontsize': 16}, wedgeprops={'edgecolor': 'black'})
+    ax.set_title(
+        f"Distribution of prices (in {settings['currency']}) for {title} (using K-Means)", color='white', size=22)
+    ax.legend(bbox_to_anchor=(1.2, 1), labels=labels, loc='upper right', fontsize='x-large',
+              labelcolor='white', frameon=True, edgecolor='white', facecolor='none')
+    fig.tight_layout()
+    fig.savefig(filename)
     logging.info(f"Pie graph saved as {filename}")
 
 
-if __name__ == "__main__":
-    search_field: str = str(input(
-        '\nPlease, type the product name that you wanna to look for:\n'
-    )).lower()  # Product name to search for
-    if search_field == '':
-        print(f'{"-="*35}\n')
-        logging.error(
-            'Sorry, i need at least one letter to start looking for a product on the websites.')
-        sys.exit()
-
-    # Ask for the currency the user wanna to use, check if its a supported one and get the symbol
-    supported_currencies: str = "\n".join(f'{abbreviation} ({name})' for abbreviation, name in zip(
-        api_all_currencies.keys(), api_all_currencies.values()) if abbreviation in symbols_hash_map.values())
-    currency: str = str(input(
-        f'\nPlease, type the abbreviation code of the currency you wanna to use on the price comlumn of the csv file (e.g., usd, gbp, eur, brl)\nThe valid currencies codes are:\n{supported_currencies}\n'
-    )).lower()
-    if currency not in dict(symbols_hash_map).values():
-        print(f'\n{"-="*35}\n')
-        logging.error(
-            f'Sorry, i could not find the currency code you typed, please run the script again and make sure you typed the currency abbreviation code right.\nThe currencies code that we support are:\n{supported_currencies}')
-        sys.exit()
-    currency_symbol: str = [
-        k for k, v in symbols_hash_map.items() if v == currency][0]
-
-    choose_to_remove_currency: str = str(input(
-        '\nDo you wanna to remove the currency symbol of each cell of the price comlumn on the csv file?\n Y (Yes) or N (No), default is Y (Yes):\n'
-    )).lower()
-    if choose_to_remove_currency not in ('no', 'n', 'not', 'na', 'nah' 'y', 'yes', 'yep', 'ye', ''):
-        print(f'\n{"-="*35}\n')
-        logging.error(
-            'Sorry, i only accept Yes, Y, No and N as possible answers')
-        sys.exit()
-    if choose_to_remove_currency in ('no', 'n', 'not', 'na', 'nah'):
-        remove_currency_from_csv = False
-
-    pages_to_scrape: int = 3
+# ------------------ Batch CLI ------------------
+
+def output_name(query: str) -> str:
+    # "USB-C Hub 65W" -> "usb-c_hub_65w"
+    slug = ''.join(c if c.isalnum() or c in '-_' else '_' for c in normalize_query(query))
+    return slug.strip('_')[:80] or 'query'
+
+
+def read_queries(args) -> list[str]:
+    queries = list(args.queries)
+    if args.file:
+        f = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')
+        with f:
+            queries.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    # Same query twice in one run would only scrape the same pages again
+    unique: dict = {}
+    for query in queries:
+        unique.setdefault(normalize_query(query), query)
+    return list(unique.values())
+
+
+def run_query(query: str, args, settings: dict) -> dict:
+    started = time.time()
+    reports: dict = {}
+    stats = QueryStats()
+    items: list = []
+    for site in args.sites:
+        report: dict = {}
+        try:
+            data = scrape_site(site, query, args.pages, settings, report)
+        except Exception as e:
+            logging.exception(f"{site} failed for '{query}'")
+            report['error'] = str(e)
+            data = []
+        report['items'] = len(data)
+        reports[site] = report
+        stats.add_items(site, data)
+        items.extend(data)
+
+    name = output_name(query)
+    path = os.path.join(args.out_dir, f'{name}.{args.format}')
+    if args.format == 'parquet':
+        save_to_parquet(items, path)
+    else:
+        save_to_csv(items, path)
+    if args.graph:
+        pie_graph(items, os.path.join(args.out_dir, f'{name}_graph.png'), query, settings)
+    return {
+        'query': query,
+        'file': path if items else None,
+        'items': len(items),
+        'sites': reports,
+        'stats': stats.summary(),
+        'seconds': round(time.time() - started, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape product prices for many queries at once')
+    parser.add_argument('queries', nargs='*', help='product names to search for')
+    parser.add_argument('--file', help="file with one query per line ('-' for stdin)")
+    parser.add_argument('--sites', default=','.join(SEARCH_URLS),
+                        type=lambda s: [x.strip() for x in s.split(',') if x.strip()],
+                        help=f"comma separated, from: {', '.join(SEARCH_URLS)}")
+    parser.add_argument('--pages', type=int, default=3, help='pages per site (default 3)')
+    parser.add_argument('--currency', default='usd', type=str.lower,
+                        choices=sorted(set(symbols_hash_map.values())))
+    parser.add_argument('--keep-symbol', action='store_true', help='keep the currency symbol in the price column')
+    parser.add_argument('--concurrency', type=int, default=BROWSER_WORKERS * 2,
+                        help='queries scraped at the same time')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--graph', action='store_true', help='also draw a price pie graph per query')
+    args = parser.parse_args()
+
+    queries = read_queries(args)
+    if not queries:
+        parser.error('no queries given (pass them as arguments or with --file)')
+    unknown = [s for s in args.sites if s not in SEARCH_URLS]
+    if unknown:
+        parser.error(f"unknown site(s): {', '.join(unknown)}")
+    if args.pages < 1:
+        parser.error('--pages must be at least 1')
+    if args.format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('--format parquet needs pyarrow (pip install pyarrow)')
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    settings = currency_settings(args.currency, remove_currency=not args.keep_symbol)
+    started = time.time()
+    logging.info(f"Scraping {len(queries)} queries on {', '.join(args.sites)} ({args.concurrency} at a time)")
+    results: list = []
+    errors: list = []
     try:
-        pages_to_scrape: int = int(input(
-            '\nHow much page for each website do you wanna to scrap data? (the default is 3):\n'))
-    except:
-        print(f'\n{"-="*35}\n')
-        logging.error('Sorry, i only accept numbers as possible answer')
-        sys.exit()
-
-    urls_to_scrape: list[str] = [
-        f'https://amazon.com/s?k={search_field}&s=exact-aware-popularity-rank',
-        # f'https://aliexpress.com/w/wholesale-{search_field}.html?sortType=total_tranpro_desc',
-        f'https://ebay.com/sch/i.html?_nkw={search_field}'
-    ]  # Target websites | aliexpress, amazon and ebay |
-
-    all_scraped_data: list[dict] = []
-    api_url_for_currencies: dict = requests.get(
-        f'https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies/{currency}.json').json()
-    for url in urls_to_scrape:
-        scraped_data = scrape_website(
-            url, headers=headers, pages=pages_to_scrape)
-        all_scraped_data.extend(scraped_data)
-
-    save_to_csv(all_scraped_data, 'scraped_data.csv')
-    pie_graph(all_scraped_data, 'scraped_data_graph.png')
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            futures = {executor.submit(run_query, q, args, settings): q for q in queries}
+            for future, query in futures.items():
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logging.exception(f"Query '{query}' failed")
+                    errors.append({'query': query, 'error': str(e)})
+    finally:
+        close_browser_pool()
+        get_parse_pool().shutdown()
+
+    summary = {
+        'started_at': started,
+        'seconds': round(time.time() - started, 1),
+        'currency': args.currency,
+        'sites': args.sites,
+        'pages': args.pages,
+        'queries': results,
+        'errors': errors,
+        'total_items': sum(r['items'] for r in results),
+    }
+    summary_path = os.path.join(args.out_dir, 'summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"{summary['total_items']} items for {len(results)} queries in {summary['seconds']}s, summary in {summary_path}")
+    return 1 if errors or not summary['total_items'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
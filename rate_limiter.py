@@ -0,0 +1,51 @@
+# rate_limiter.py
+import os
+import time
+import threading
+from typing import Optional
+
+# Minimum spacing between page loads on one site, shared by every request
+# and batch in the process. This replaces the per-request time.sleep().
+SITE_MIN_INTERVAL_SECONDS = float(os.environ.get("SITE_MIN_INTERVAL_SECONDS", 1.0))
+
+
+class RateLimiter:
+    # Callers reserve the next free slot for a key and sleep until it comes up,
+    # so concurrent callers are served in arrival order without busy waiting.
+
+    def __init__(self, min_interval: float = SITE_MIN_INTERVAL_SECONDS):
+        self.min_interval = min_interval
+        self._next_slot: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, max_wait: Optional[float] = None) -> Optional[float]:
+        # Returns how long the caller has to wait for its slot, or None (and
+        # reserves nothing) when that would be longer than max_wait
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, 0.0))
+            if max_wait is not None and slot - now > max_wait:
+                return None
+            self._next_slot[key] = slot + self.min_interval
+        return slot - now
+
+    def acquire(self, key: str, max_wait: Optional[float] = None) -> bool:
+        # False when no slot comes up within max_wait
+        wait = self.reserve(key, max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def backlog(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {k: round(max(0.0, v - now), 2) for k, v in self._next_slot.items()}
+
+
+_limiter = RateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    return _limiter
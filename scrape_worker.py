@@ -0,0 +1,62 @@
+# scrape_worker.py
+# Pulls (site, query, page) tasks from the work queue and scrapes them.
+# Run as many of these as the host (or hosts sharing the queue) can take:
+#   WORK_QUEUE_URL=sqlite:////data/work_queue.db python scrape_worker.py
+import os
+import time
+import socket
+import logging
+import argparse
+import threading
+from crawler import scrape_page
+from work_queue import LEASE_SECONDS, Task, WorkQueue, get_work_queue
+
+
+def heartbeat_loop(queue: WorkQueue, task: Task, worker_id: str, lease_seconds: float, stop: threading.Event):
+    # Renew well before expiry so a slow page load does not lose the lease.
+    while not stop.wait(lease_seconds / 3):
+        if not queue.heartbeat(task.id, worker_id, lease_seconds):
+            logging.warning(f"Lost lease on task {task.id}")
+            return
+
+
+def run_task(queue: WorkQueue, task: Task, worker_id: str, lease_seconds: float):
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat_loop, args=(queue, task, worker_id, lease_seconds, stop), daemon=True)
+    beat.start()
+    try:
+        logging.info(f"Task {task.id} (attempt {task.attempts}): {task.url}")
+        rows = scrape_page(task.url, task.site)
+        if not queue.complete(task.id, worker_id, rows):
+            logging.warning(f"Task {task.id} finished after its lease expired, result dropped")
+    except Exception as e:
+        logging.error(f"Task {task.id} failed: {e}")
+        queue.fail(task.id, worker_id, str(e))
+    finally:
+        stop.set()
+        beat.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape worker for the shared work queue")
+    parser.add_argument("--queue", default=None, help="work queue URL (default: $WORK_QUEUE_URL)")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="lease length in seconds")
+    parser.add_argument("--idle-sleep", type=float, default=1.0, help="seconds to wait when the queue is empty")
+    parser.add_argument("--sleep-time", type=float, default=1.0, help="pause between page loads")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    queue = get_work_queue(args.queue) if args.queue else get_work_queue()
+    logging.info(f"Worker {args.worker_id} started")
+    while True:
+        task = queue.lease(args.worker_id, args.lease)
+        if task is None:
+            time.sleep(args.idle_sleep)
+            continue
+        run_task(queue, task, args.worker_id, args.lease)
+        time.sleep(args.sleep_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# single_flight.py
+# Coalesces identical work that is in flight at the same time: the first
+# caller for a key does the work and publishes its partial results as a
+# stream; callers arriving meanwhile follow that stream instead of
+# repeating the work. Nothing is cached once the work has finished.
+import threading
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+from deadline import Deadline
+
+
+class Flight:
+    # One piece of work and everything it has published so far.
+
+    def __init__(self, key: Hashable, deadline: Optional[Deadline] = None):
+        self.key = key
+        self.deadline = deadline  # the worker's; None runs until the work is done
+        self.entries: list = []
+        self.done = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.active = 0  # callers still interested in more entries
+        self._cond = threading.Condition()
+
+    def publish(self, entry: Any):
+        with self._cond:
+            self.entries.append(entry)
+            self._cond.notify_all()
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None):
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self._cond.notify_all()
+
+    def wanted(self) -> bool:
+        # The worker can stop early once every caller has left
+        with self._cond:
+            return self.active > 0
+
+    def leave(self):
+        with self._cond:
+            self.active = max(0, self.active - 1)
+
+    def covers(self, deadline: Optional[Deadline]) -> bool:
+        # Whether the work may run at least as long as a caller with this deadline needs
+        if self.deadline is None:
+            return True
+        return deadline is not None and self.deadline.expires_at >= deadline.expires_at
+
+    def follow(self, deadline: Optional[Deadline] = None) -> Iterator[Any]:
+        # Yields every entry in order, including those published before the
+        # caller joined. Raises TimeoutError if the deadline passes first and
+        # re-raises the worker's error.
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.entries) and not self.done:
+                    if deadline is not None and deadline.expired:
+                        raise TimeoutError(f"Deadline reached following {self.key}")
+                    self._cond.wait(None if deadline is None else deadline.remaining())
+                if i >= len(self.entries):
+                    if self.error is not None:
+                        raise self.error
+                    return
+                entry = self.entries[i]
+            i += 1
+            yield entry
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+        self.outlasted = 0  # flights not joined because their deadline was too short
+
+    def join(self, key: Hashable, deadline: Optional[Deadline] = None) -> Tuple[Flight, bool]:
+        # Returns the flight for key and whether the caller has to do the work.
+        # A flight that would stop before the caller's deadline isn't joined:
+        # the caller starts its own, which later callers join instead.
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or not flight.covers(deadline)
+            if leader:
+                if flight is not None:
+                    self.outlasted += 1
+                flight = self._flights[key] = Flight(key, deadline)
+                self.started += 1
+            else:
+                flight.followers += 1
+                self.coalesced += 1
+            with flight._cond:
+                flight.active += 1
+            return flight, leader
+
+    def land(self, flight: Flight, result: Any = None, error: Optional[BaseException] = None):
+        # Called by the leader when the work ends; later callers start afresh
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.finish(result, error)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"in_flight": len(self._flights), "started": self.started, "coalesced": self.coalesced,
+                    "outlasted": self.outlasted}
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
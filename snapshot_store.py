@@ -0,0 +1,213 @@
+# snapshot_store.py
+# Content-addressed store of raw results pages, so extractors and price
+# conversion can be re-run offline:
+#   python snapshot_store.py list --site ebay --query "desk lamp"
+#   python snapshot_store.py replay --site ebay --currency usd --out replay.csv
+import os
+import csv
+import gzip
+import time
+import hashlib
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Iterator, Optional
+from urllib.parse import urlsplit, parse_qs
+from pagination import SITE_PAGINATION
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ------------------ Setup ------------------
+# Snapshots are only taken when SNAPSHOT_DIR is set
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "")
+ZSTD_LEVEL = int(os.environ.get("SNAPSHOT_ZSTD_LEVEL", 6))
+REPLAY_CHUNK = 64
+
+QUERY_PARAMS = {"amazon": "k", "ebay": "_nkw"}
+
+
+def url_query_and_page(site: str, url: str) -> tuple[Optional[str], Optional[int]]:
+    params = parse_qs(urlsplit(url).query)
+    query = params.get(QUERY_PARAMS.get(site, ""), [None])[0]
+    page_param = SITE_PAGINATION[site].page_param if site in SITE_PAGINATION else "page"
+    page = params.get(page_param, [None])[0]
+    return query, int(page) if page and page.isdigit() else None
+
+
+class SnapshotStore:
+    # Objects live at objects/<h[:2]>/<h>.<codec>, keyed by the sha256 of the
+    # raw HTML, so identical pages are stored once. index.db maps
+    # site/query/page/time to hashes.
+
+    def __init__(self, root: str):
+        self.root = root
+        self.codec = "zst" if zstandard is not None else "gz"
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                site TEXT NOT NULL,
+                query TEXT,
+                page INTEGER,
+                url TEXT NOT NULL,
+                status INTEGER,
+                fetched_at REAL NOT NULL,
+                hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS snapshots_lookup ON snapshots (site, query, page, fetched_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(
+                os.path.join(self.root, "index.db"), timeout=30, isolation_level=None)
+        return conn
+
+    def _object_path(self, digest: str, codec: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.{codec}")
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == "zst":
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    @staticmethod
+    def _decompress(data: bytes, codec: str) -> bytes:
+        if codec == "zst":
+            if zstandard is None:
+                raise RuntimeError("zstandard is needed to read .zst snapshots")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def save(self, site: str, url: str, status: Optional[int], html: bytes,
+             query: Optional[str] = None, page: Optional[int] = None) -> str:
+        digest = hashlib.sha256(html).hexdigest()
+        path = self._object_path(digest, self.codec)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(self._compress(html))
+            os.replace(tmp, path)
+        url_query, url_page = url_query_and_page(site, url)
+        self._conn().execute(
+            "INSERT INTO snapshots (site, query, page, url, status, fetched_at, hash, size, codec) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (site, query or url_query, page or url_page or 1, url, status, time.time(), digest, len(html), self.codec),
+        )
+        return digest
+
+    def find(self, site: Optional[str] = None, query: Optional[str] = None,
+             since: Optional[float] = None, until: Optional[float] = None,
+             latest_only: bool = False) -> list[dict]:
+        clauses, params = [], []
+        for column, value in (("site", site), ("query", query)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("fetched_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("fetched_at <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT site, query, page, url, status, fetched_at, hash, size, codec FROM snapshots {where} "
+            "ORDER BY site, query, page, fetched_at", params
+        ).fetchall()
+        keys = ("site", "query", "page", "url", "status", "fetched_at", "hash", "size", "codec")
+        found = [dict(zip(keys, row)) for row in rows]
+        if latest_only:
+            latest = {}
+            for snap in found:
+                latest[(snap["site"], snap["query"], snap["page"])] = snap
+            found = list(latest.values())
+        return found
+
+    def load(self, digest: str, codec: Optional[str] = None) -> bytes:
+        codec = codec or self.codec
+        with open(self._object_path(digest, codec), "rb") as f:
+            return self._decompress(f.read(), codec)
+
+    def replay(self, snapshots: list[dict], settings: Optional[dict] = None) -> Iterator[dict]:
+        # Re-run the extractors (in the parse pool) and price conversion on
+        # stored pages; no browser or network involved.
+        from parse_pool import get_parse_pool
+        from app_fastapi import rows_to_items
+        pool = get_parse_pool()
+        for start in range(0, len(snapshots), REPLAY_CHUNK):
+            chunk = snapshots[start:start + REPLAY_CHUNK]
+            pages = [(self.load(s["hash"], s["codec"]), s["site"]) for s in chunk]
+            for snap, rows in zip(chunk, pool.parse_many(pages)):
+                items = rows_to_items(rows, snap["site"], settings) if settings else [
+                    {"Name": row[0], "Price": row[1], "Link": row[2], "Image": row[3] if len(row) > 3 else ""}
+                    for row in rows]
+                for item in items:
+                    yield {"Site": snap["site"], "Query": snap["query"], "Page": snap["page"],
+                           "FetchedAt": snap["fetched_at"], **item}
+
+
+_store: Optional[SnapshotStore] = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store() -> Optional[SnapshotStore]:
+    global _store
+    if not SNAPSHOT_DIR:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore(SNAPSHOT_DIR)
+        return _store
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Inspect and replay stored results pages")
+    parser.add_argument("command", choices=["list", "replay"])
+    parser.add_argument("--dir", default=SNAPSHOT_DIR or "snapshots")
+    parser.add_argument("--site")
+    parser.add_argument("--query")
+    parser.add_argument("--since", type=float, help="unix timestamp")
+    parser.add_argument("--until", type=float, help="unix timestamp")
+    parser.add_argument("--all-versions", action="store_true", help="replay every capture, not just the latest")
+    parser.add_argument("--currency", help="convert prices (fetches rates once); raw price text otherwise")
+    parser.add_argument("--out", default="replay.csv")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.dir)
+    snapshots = store.find(args.site, args.query, args.since, args.until, latest_only=not args.all_versions)
+    if args.command == "list":
+        for snap in snapshots:
+            print(f"{snap['site']}\t{snap['query']}\t{snap['page']}\t{time.ctime(snap['fetched_at'])}\t{snap['hash'][:12]}")
+        return
+
+    settings = None
+    if args.currency:
+        from app_fastapi import currency_settings
+        settings = currency_settings(args.currency.lower())
+    started = time.time()
+    count = 0
+    with open(args.out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["Site", "Query", "Page", "FetchedAt", "Name", "Price", "Link", "Image"],
+                                extrasaction="ignore")
+        writer.writeheader()
+        for item in store.replay(snapshots, settings):
+            writer.writerow(item)
+            count += 1
+    elapsed = time.time() - started
+    logging.info(f"Replayed {len(snapshots)} pages ({count} items) in {elapsed:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# spill.py
+# Helpers that keep a scrape's memory flat no matter how many pages it covers.
+import os
+import json
+import random
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+
+SPILL_THRESHOLD_ITEMS = int(os.environ.get("SPILL_THRESHOLD_ITEMS", 2000))
+SPILL_DIR = os.environ.get("SPILL_DIR") or None  # default: system temp dir
+MAX_PAGES_PER_REQUEST = int(os.environ.get("MAX_PAGES_PER_REQUEST", 20))
+MAX_ITEMS_PER_REQUEST = int(os.environ.get("MAX_ITEMS_PER_REQUEST", 20000))
+MAX_BYTES_PER_REQUEST = int(os.environ.get("MAX_BYTES_PER_REQUEST", 200 * 1024 * 1024))
+CHART_SAMPLE_SIZE = int(os.environ.get("CHART_SAMPLE_SIZE", 2000))
+
+
+class RequestBudget:
+    # Items and downloaded HTML bytes one request may consume.
+
+    def __init__(self, max_items: int = MAX_ITEMS_PER_REQUEST, max_bytes: int = MAX_BYTES_PER_REQUEST):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def charge_page(self, nbytes: int):
+        with self._lock:
+            self.bytes += nbytes
+
+    def take_items(self, items: List[Dict]) -> List[Dict]:
+        # Returns the part of items that still fits in the budget
+        with self._lock:
+            room = max(0, self.max_items - self.items)
+            taken = items[:room]
+            self.items += len(taken)
+            return taken
+
+    @property
+    def exhausted(self) -> Optional[str]:
+        if self.items >= self.max_items:
+            return f"item cap ({self.max_items}) reached"
+        if self.bytes >= self.max_bytes:
+            return f"byte cap ({self.max_bytes}) reached"
+        return None
+
+    def to_dict(self) -> Dict:
+        return {"items": self.items, "max_items": self.max_items, "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+class ReservoirSample:
+    # Uniform sample of a stream (Algorithm R), used for the price chart.
+
+    def __init__(self, size: int = CHART_SAMPLE_SIZE, seed: int = 0):
+        self.size = size
+        self.seen = 0
+        self.items: List[Dict] = []
+        self._random = random.Random(seed)
+
+    def add(self, item: Dict):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            j = self._random.randrange(self.seen)
+            if j < self.size:
+                self.items[j] = item
+
+
+class ItemSpool:
+    # Collects scraped items; once more than threshold are buffered they are
+    # appended to a JSON-lines temp file in batches. iter() replays everything
+    # in order without loading it all back.
+
+    def __init__(self, threshold: int = SPILL_THRESHOLD_ITEMS, preview_size: int = 5,
+                 sample_size: int = CHART_SAMPLE_SIZE):
+        self.threshold = threshold
+        self.count = 0
+        self.preview: List[Dict] = []
+        self.preview_size = preview_size
+        self.sample = ReservoirSample(sample_size)
+        self._buffer: List[Dict] = []
+        self._file = None
+        self._lock = threading.Lock()
+
+    def extend(self, items: Iterable[Dict]):
+        with self._lock:
+            for item in items:
+                self.count += 1
+                if len(self.preview) < self.preview_size:
+                    self.preview.append(item)
+                self.sample.add(item)
+                self._buffer.append(item)
+            if len(self._buffer) >= self.threshold:
+                self._spill()
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=SPILL_DIR,
+                                                     prefix="spool-", suffix=".jsonl", delete=False)
+        self._file.writelines(json.dumps(item) + "\n" for item in self._buffer)
+        self._file.flush()
+        self._buffer = []
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Dict]:
+        # Snapshot what has been spilled so far; reading uses its own handle
+        # so the spool stays usable while a consumer walks through it.
+        with self._lock:
+            path = self._file.name if self._file is not None else None
+            spilled_bytes = self._file.tell() if self._file is not None else 0
+            buffered = list(self._buffer)
+        if path:
+            with open(path, "rb") as f:
+                while f.tell() < spilled_bytes:
+                    yield json.loads(f.readline())
+        yield from buffered
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                os.remove(self._file.name)
+                self._file = None
+            self._buffer = []
@@ -0,0 +1,107 @@
+# tests/test_admission.py
+import pytest
+from admission import AdmissionController, AdmissionRejected, resolve_client
+
+
+# ------------------ Fair queueing ------------------
+
+def test_light_client_is_not_stuck_behind_heavy_backlog():
+    ctl = AdmissionController(slots=1, per_client=1)
+    order, tickets = [], []
+
+    def admitted(ticket):
+        order.append(ticket.client)
+        tickets.append(ticket)
+
+    for _ in range(10):
+        ctl.enqueue("busy", admitted)
+    ctl.enqueue("light", admitted)
+    while tickets:
+        ctl.release(tickets.pop(0))
+    # The light client's request goes ahead of most of the busy client's backlog
+    assert len(order) == 11
+    assert order.index("light") <= 2
+
+
+def test_weights_share_slots_in_proportion():
+    ctl = AdmissionController(slots=1, per_client=1, weights={"gold": 2.0})
+    order = []
+    held = ctl.enqueue("blocker", lambda t: order.append(t.client))
+    tickets = []
+    for _ in range(6):
+        ctl.enqueue("gold", lambda t: (order.append(t.client), tickets.append(t)))
+        ctl.enqueue("plain", lambda t: (order.append(t.client), tickets.append(t)))
+    ctl.release(held)
+    while tickets:
+        ctl.release(tickets.pop(0))
+    served = order[1:7]
+    assert served.count("gold") == 4 and served.count("plain") == 2
+
+
+def test_per_client_cap_lets_others_through():
+    ctl = AdmissionController(slots=3, per_client=1)
+    order = []
+    for client in ("a", "a", "b"):
+        ctl.enqueue(client, lambda t: order.append(t.client))
+    assert order == ["a", "b"]
+    assert ctl.metrics()["clients"]["a"] == {"running": 1, "queued": 1, "batches": 0}
+
+
+# ------------------ Limits ------------------
+
+def test_admit_runs_and_releases():
+    ctl = AdmissionController(slots=1)
+    with ctl.admit("a", timeout=1):
+        assert ctl.in_use == 1
+    assert ctl.in_use == 0
+
+
+def test_admit_times_out_with_retry_after():
+    ctl = AdmissionController(slots=1)
+    ctl.enqueue("a", lambda t: None)
+    with pytest.raises(AdmissionRejected) as e:
+        with ctl.admit("b", timeout=0.01):
+            pass
+    assert e.value.retry_after >= 1
+    assert ctl.timed_out == 1 and not ctl.waiting
+
+
+def test_check_rejects_full_client_queue():
+    ctl = AdmissionController(slots=1, client_queue_limit=1)
+    ctl.enqueue("a", lambda t: None)
+    ctl._enqueue("a", 1.0, 1, bounded=True)
+    with pytest.raises(AdmissionRejected, match="this client"):
+        ctl.check("a")
+    ctl.check("b")
+
+
+def test_check_rejects_full_queue():
+    ctl = AdmissionController(slots=1, queue_limit=2)
+    ctl.enqueue("x", lambda t: None)
+    ctl._enqueue("a", 1.0, 1, bounded=True)
+    ctl._enqueue("b", 1.0, 1, bounded=True)
+    with pytest.raises(AdmissionRejected, match="queue is full"):
+        ctl.check("c")
+    assert ctl.rejected == 1
+
+
+def test_batch_units_do_not_count_but_batches_do():
+    ctl = AdmissionController(slots=1, queue_limit=10, client_queue_limit=2)
+    for _ in range(20):
+        ctl.enqueue("a", lambda t: None)
+    ctl.begin_batch("a")
+    ctl.begin_batch("a")
+    with pytest.raises(AdmissionRejected):
+        ctl.begin_batch("a")
+    with pytest.raises(AdmissionRejected):
+        ctl.check("a")
+    ctl.end_batch("a")
+    ctl.begin_batch("a")
+    assert ctl.metrics()["batches"] == 2
+
+
+# ------------------ Client identity ------------------
+
+def test_client_header_needs_a_trusted_proxy():
+    assert resolve_client("10.0.0.5", client_header="made-up") == "10.0.0.5"
+    assert resolve_client(None) == "unknown"
@@ -0,0 +1,21 @@
+# tests/test_pagination.py
+from pagination import link_key
+
+
+def test_amazon_links_keyed_by_asin():
+    assert link_key("https://amazon.com/Desk-Lamp/dp/B0ABCDEFGH/ref=sr_1_3?qid=1") == "amazon:B0ABCDEFGH"
+    assert link_key("https://amazon.com/dp/B0ABCDEFGH/ref=sr_2_7") == "amazon:B0ABCDEFGH"
+
+
+def test_sponsored_amazon_links_keyed_by_asin():
+    sponsored = "https://amazon.com/sspa/click?url=%2FDesk-Lamp%2Fdp%2FB0ABCDEFGH%2Fref%3Dsr_1_1_sspa"
+    assert link_key(sponsored) == "amazon:B0ABCDEFGH"
+
+
+def test_ebay_links_keyed_by_item_id():
+    assert link_key("https://www.ebay.com/itm/Desk-Lamp/123456789012?hash=item1") == "ebay:123456789012"
+    assert link_key("https://www.ebay.com/itm/123456789012?_trkparms=x") == "ebay:123456789012"
+
+
+def test_unknown_links_fall_back_to_url():
+    assert link_key("https://example.com/item/") == "https://example.com/item"
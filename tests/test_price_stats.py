@@ -0,0 +1,28 @@
+# tests/test_price_stats.py
+import random
+from price_stats import TDigest
+
+
+def test_merged_digest_matches_one_digest():
+    rng = random.Random(7)
+    prices = [rng.lognormvariate(3, 1) for _ in range(5000)]
+    whole, left, right = TDigest(), TDigest(), TDigest()
+    for i, price in enumerate(prices):
+        whole.add(price)
+        (left if i % 2 else right).add(price)
+    left.merge(right)
+    prices.sort()
+    assert left.total == whole.total == len(prices)
+    for q in (0.01, 0.5, 0.99):
+        exact = prices[int(q * len(prices))]
+        assert abs(left.quantile(q) - exact) / exact < 0.05
+        assert abs(whole.quantile(q) - exact) / exact < 0.05
+
+
+def test_round_trip_keeps_quantiles():
+    digest = TDigest()
+    for price in range(1, 1001):
+        digest.add(float(price))
+    copy = TDigest.from_dict(digest.to_dict())
+    assert copy.quantile(0.5) == digest.quantile(0.5)
+    assert TDigest().quantile(0.5) is None
@@ -0,0 +1,59 @@
+# tests/test_single_flight.py
+import threading
+import pytest
+from deadline import Deadline
+from single_flight import SingleFlight
+
+
+def test_followers_get_every_entry():
+    flights = SingleFlight()
+    flight, leader = flights.join("lamp")
+    flight.publish(1)
+    same, follower_leads = flights.join("lamp")
+    assert leader and not follower_leads and same is flight
+
+    def work():
+        flight.publish(2)
+        flights.land(flight, result="report")
+
+    threading.Thread(target=work).start()
+    assert list(same.follow(Deadline(5))) == [1, 2]
+    assert same.result == "report"
+    assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 1, "outlasted": 0}
+
+
+def test_leaving_callers_stop_the_work():
+    flights = SingleFlight()
+    flight, _ = flights.join("lamp")
+    flights.join("lamp")
+    flight.leave()
+    assert flight.wanted()
+    flight.leave()
+    assert not flight.wanted()
+
+
+def test_followers_get_the_leaders_error():
+    flights = SingleFlight()
+    flight, _ = flights.join("lamp")
+    flights.land(flight, error=RuntimeError("browser died"))
+    with pytest.raises(RuntimeError):
+        list(flight.follow())
+    assert flights.join("lamp")[1]  # landed flights are not joined again
+
+
+def test_follow_times_out():
+    flight, _ = SingleFlight().join("lamp")
+    with pytest.raises(TimeoutError):
+        list(flight.follow(Deadline(0.01)))
+
+
+def test_short_flight_does_not_cover_longer_deadline():
+    flights = SingleFlight()
+    short, _ = flights.join("lamp", Deadline(1))
+    assert short.covers(Deadline(0.5))
+    assert not short.covers(Deadline(10))
+    assert not short.covers(None)
+    longer, leader = flights.join("lamp", Deadline(10))
+    assert leader and longer is not short
+    assert flights.stats()["outlasted"] == 1
+    assert flights.join("lamp", Deadline(5))[0] is longer
@@ -0,0 +1,22 @@
+# tests/test_thumbnails.py
+from thumbnails import ThumbnailCache, allowed_image
+
+
+def test_only_marketplace_image_hosts_allowed():
+    assert allowed_image("https://m.media-amazon.com/images/I/71abc.jpg")
+    assert allowed_image("https://i.ebayimg.com/thumbs/images/g/abc/s-l500.jpg")
+    assert not allowed_image("http://169.254.169.254/latest/meta-data/")
+    assert not allowed_image("https://m.media-amazon.com.example.net/x.jpg")
+    assert not allowed_image("file:///etc/passwd")
+    assert not allowed_image("http://[::1")
+
+
+def test_enqueue_skips_other_hosts(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), workers=1)
+    fetched = []
+    cache._executor.submit = lambda fn, key, url: fetched.append(url)
+    cache.enqueue(["http://localhost:8000/admin", "https://i.ebayimg.com/a.jpg"])
+    assert fetched == ["https://i.ebayimg.com/a.jpg"]
+    assert cache.lookup("nope") is None
+    assert cache.metrics()["queued"] == 1
+    cache.close()
@@ -0,0 +1,70 @@
+# tests/test_work_queue.py
+import time
+import pytest
+from work_queue import SQLiteWorkQueue, get_work_queue
+
+
+def task(page: int) -> dict:
+    return {"site": "ebay", "query": "lamp", "page": page, "url": f"https://ebay.com/sch/i.html?_nkw=lamp&_pgn={page}"}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteWorkQueue(str(tmp_path / "queue.db"), max_attempts=2)
+
+
+def test_lease_in_order_and_complete(queue):
+    queue.put("job", [task(1), task(2)])
+    first = queue.lease("w1")
+    second = queue.lease("w2")
+    assert (first.page, second.page) == (1, 2)
+    assert queue.lease("w3") is None
+    assert queue.complete(first.id, "w1", [["Lamp", "$5", "link", ""]])
+    assert not queue.complete(second.id, "w1", [])  # not w1's lease
+    status = queue.job_status("job")
+    assert (status["done"], status["leased"], status["finished"]) == (1, 1, False)
+    results = queue.job_results("job")
+    assert results[0][1] == [["Lamp", "$5", "link", ""]]
+
+
+def test_expired_lease_is_reclaimed(queue):
+    queue.put("job", [task(1)])
+    lost = queue.lease("w1", lease_seconds=-1)
+    again = queue.lease("w2")
+    assert again.id == lost.id and again.attempts == 2
+    assert not queue.heartbeat(lost.id, "w1")
+    assert queue.heartbeat(again.id, "w2")
+
+
+def test_fail_retries_up_to_max_attempts(queue):
+    queue.put("job", [task(1)])
+    queue.fail(queue.lease("w1").id, "w1", "boom")
+    retry = queue.lease("w1")
+    assert retry.attempts == 2
+    queue.fail(retry.id, "w1", "boom")
+    assert queue.lease("w1") is None
+    status = queue.job_status("job")
+    assert status["failed"] == 1 and status["finished"]
+
+
+def test_cancel_drops_pending_only(queue):
+    queue.put("job", [task(1), task(2)])
+    leased = queue.lease("w1")
+    assert queue.cancel("job") == 1
+    assert queue.complete(leased.id, "w1", [])
+    assert queue.job_status("job")["finished"]
+
+
+def test_prune_keeps_unfinished_jobs(queue):
+    queue.put("old", [task(1)])
+    queue.put("open", [task(1)])
+    queue.complete(queue.lease("w1").id, "w1", [])
+    time.sleep(0.01)
+    assert queue.prune(older_than=0) == 1
+    assert queue.job_status("old")["total"] == 0
+    assert queue.job_status("open")["pending"] == 1
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_work_queue("nosuch://queue")
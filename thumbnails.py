@@ -0,0 +1,209 @@
+# thumbnails.py
+# Local cache of product thumbnails, so product cards don't hot-link
+# marketplace images. Image URLs found while scraping are queued and
+# downloaded in the background by a small pool; each image is resized to a
+# WebP stored under the sha256 of the original bytes, so the same picture
+# reached through different URLs is kept once.
+#   objects/<h[:2]>/<h>.webp   the resized images
+#   index.db                   image URL -> content hash
+import io
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+from browser_pool import SCRAPER_BACKEND
+from http_client import get_http_client
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# ------------------ Setup ------------------
+# On by default when Pillow is installed; the fake backend's images don't exist
+THUMBNAILS = os.environ.get("THUMBNAILS", "0" if SCRAPER_BACKEND == "fake" else "1") == "1"
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", "thumbnails")
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", 256))            # longest side, pixels
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", 80))
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 4))         # downloads in flight
+THUMBNAIL_QUEUE_LIMIT = int(os.environ.get("THUMBNAIL_QUEUE_LIMIT", 2000))
+THUMBNAIL_MAX_BYTES = int(os.environ.get("THUMBNAIL_MAX_BYTES", 5 * 1024 * 1024))
+THUMBNAIL_TIMEOUT_SECONDS = float(os.environ.get("THUMBNAIL_TIMEOUT_SECONDS", 10))
+# Failed downloads are tried again after this long
+THUMBNAIL_RETRY_SECONDS = float(os.environ.get("THUMBNAIL_RETRY_SECONDS", 6 * 3600))
+# Image URLs come from scraped pages, so only the marketplaces' image CDNs
+# are fetched; anything else could point the server at internal addresses
+THUMBNAIL_HOSTS = {h.strip().lower() for h in
+                   os.environ.get("THUMBNAIL_HOSTS", "m.media-amazon.com,i.ebayimg.com").split(",") if h.strip()}
+
+
+def url_key(image_url: str) -> str:
+    return hashlib.sha256(image_url.encode("utf-8")).hexdigest()[:32]
+
+
+def allowed_image(image_url: str) -> bool:
+    try:
+        parts = urlsplit(image_url)
+        return parts.scheme in ("http", "https") and (parts.hostname or "") in THUMBNAIL_HOSTS
+    except ValueError:
+        return False
+
+
+def thumbnail_path(image_url: str) -> str:
+    # Where an item's thumbnail is served from, known before it is downloaded
+    return f"/thumbnails/by-url/{url_key(image_url)}"
+
+
+class ThumbnailCache:
+
+    def __init__(self, root: str, workers: int = THUMBNAIL_WORKERS):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self.counters = {"queued": 0, "downloaded": 0, "deduplicated": 0, "failed": 0, "dropped": 0}
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                url_key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                hash TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )""")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(
+                os.path.join(self.root, "index.db"), timeout=30, isolation_level=None)
+        return conn
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.webp")
+
+    def lookup(self, key: str) -> Optional[tuple]:
+        # (original URL, content hash or None) for a url_key
+        return self._conn().execute("SELECT url, hash FROM thumbnails WHERE url_key = ?", (key,)).fetchone()
+
+    def enqueue(self, image_urls: Iterable[str]):
+        # Never blocks the scrape: known URLs are skipped, and past
+        # THUMBNAIL_QUEUE_LIMIT pending downloads new ones are dropped.
+        # URLs off THUMBNAIL_HOSTS are never recorded or fetched.
+        conn = self._conn()
+        now = time.time()
+        for image_url in set(u for u in image_urls if u and allowed_image(u)):
+            key = url_key(image_url)
+            row = conn.execute("SELECT hash, updated_at FROM thumbnails WHERE url_key = ?", (key,)).fetchone()
+            if row and (row[0] or now - row[1] < THUMBNAIL_RETRY_SECONDS):
+                continue
+            with self._lock:
+                if key in self._pending:
+                    continue
+                dropped = len(self._pending) >= THUMBNAIL_QUEUE_LIMIT
+                if dropped:
+                    self.counters["dropped"] += 1
+                else:
+                    self._pending.add(key)
+                    self.counters["queued"] += 1
+            if dropped:
+                # Still recorded, so /thumbnails/by-url/ can redirect to the
+                # original; the next scrape that sees it tries again.
+                conn.execute("INSERT OR IGNORE INTO thumbnails (url_key, url, updated_at) VALUES (?, ?, 0)",
+                             (key, image_url))
+                continue
+            conn.execute(
+                "INSERT INTO thumbnails (url_key, url, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(url_key) DO UPDATE SET updated_at = excluded.updated_at", (key, image_url, now))
+            self._executor.submit(self._fetch, key, image_url)
+
+    def _download(self, image_url: str) -> bytes:
+        # Streamed, so an oversized image is dropped without being read whole
+        too_large = ValueError(f"image larger than {THUMBNAIL_MAX_BYTES} bytes")
+        if not allowed_image(image_url):
+            raise ValueError("image host not in THUMBNAIL_HOSTS")
+        # Redirects aren't followed, they could lead off the allowed hosts
+        with get_http_client().get(image_url, timeout=THUMBNAIL_TIMEOUT_SECONDS, stream=True,
+                                   allow_redirects=False) as response:
+            if response.is_redirect:
+                raise ValueError(f"redirected to {response.headers.get('Location')}")
+            response.raise_for_status()
+            if not response.headers.get("Content-Type", "image/").startswith("image/"):
+                raise ValueError(f"not an image ({response.headers.get('Content-Type')})")
+            length = response.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) > THUMBNAIL_MAX_BYTES:
+                raise too_large
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > THUMBNAIL_MAX_BYTES:
+                    raise too_large
+        return bytes(data)
+
+    def _store(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            with self._lock:
+                self.counters["deduplicated"] += 1
+            return digest
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                img.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))  # JPEG: decode at reduced size
+                img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                img.save(tmp, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)  # a failed save leaves no partial file behind
+        with self._lock:
+            self.counters["downloaded"] += 1
+        return digest
+
+    def _fetch(self, key: str, image_url: str):
+        try:
+            digest = self._store(self._download(image_url))
+            self._conn().execute("UPDATE thumbnails SET hash = ?, error = NULL, updated_at = ? WHERE url_key = ?",
+                                 (digest, time.time(), key))
+        except Exception as e:
+            logging.warning(f"Thumbnail for {image_url} failed: {e}")
+            with self._lock:
+                self.counters["failed"] += 1
+            self._conn().execute("UPDATE thumbnails SET error = ?, updated_at = ? WHERE url_key = ?",
+                                 (str(e)[:200], time.time(), key))
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self.counters, "pending": len(self._pending)}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_cache: Optional[ThumbnailCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> Optional[ThumbnailCache]:
+    global _cache
+    if not THUMBNAILS or Image is None:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache(THUMBNAIL_DIR)
+        return _cache
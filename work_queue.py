@@ -0,0 +1,257 @@
+# work_queue.py
+import os
+import json
+import time
+import sqlite3
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable
+
+# ------------------ Setup ------------------
+# sqlite:///path/to/queue.db is the only built-in backend; other schemes can
+# be added with register_backend() (e.g. a Redis or AMQP broker).
+WORK_QUEUE_URL = os.environ.get("WORK_QUEUE_URL", "sqlite:///work_queue.db")
+LEASE_SECONDS = float(os.environ.get("WORK_QUEUE_LEASE_SECONDS", 60))
+MAX_ATTEMPTS = int(os.environ.get("WORK_QUEUE_MAX_ATTEMPTS", 3))
+# Finished jobs are deleted this long after their last task changed
+RETENTION_SECONDS = float(os.environ.get("WORK_QUEUE_RETENTION_SECONDS", 24 * 3600))
+
+
+@dataclass
+class Task:
+    id: int
+    job_id: str
+    site: str
+    query: str
+    page: int
+    url: str
+    attempts: int
+
+
+class WorkQueue(ABC):
+    # Interface shared by every backend. A task is one (site, query, page) load.
+
+    @abstractmethod
+    def put(self, job_id: str, tasks: list[dict]) -> None: ...
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> Task | None: ...
+
+    @abstractmethod
+    def heartbeat(self, task_id: int, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> bool: ...
+
+    @abstractmethod
+    def complete(self, task_id: int, worker_id: str, result: list) -> bool: ...
+
+    @abstractmethod
+    def fail(self, task_id: int, worker_id: str, error: str) -> None: ...
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> int: ...
+
+    @abstractmethod
+    def prune(self, older_than: float = RETENTION_SECONDS) -> int: ...
+
+    @abstractmethod
+    def job_status(self, job_id: str) -> dict: ...
+
+    @abstractmethod
+    def job_results(self, job_id: str) -> list[tuple[dict, list]]: ...
+
+
+# ------------------ SQLite backend ------------------
+
+class SQLiteWorkQueue(WorkQueue):
+    # Good for several worker processes on one host. WAL mode lets readers
+    # poll job status while a worker holds the write lock to lease a task.
+
+    def __init__(self, path: str, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    site TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    result TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        # Statements run in autocommit mode; the connection is always closed
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def put(self, job_id: str, tasks: list[dict]) -> None:
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO tasks (job_id, site, query, page, url, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, t["site"], t["query"], t["page"], t["url"], now) for t in tasks],
+            )
+            conn.execute("COMMIT")
+        self.prune()
+
+    def _reclaim_expired(self, conn: sqlite3.Connection, now: float):
+        # Tasks whose worker stopped heartbeating go back to the queue, or fail
+        # for good once they have used up their attempts.
+        conn.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = 'lease expired', worker_id = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        )
+
+    def lease(self, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> Task | None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._reclaim_expired(conn, now)
+            row = conn.execute(
+                "SELECT id, job_id, site, query, page, url, attempts FROM tasks "
+                "WHERE status = 'pending' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return Task(*row[:6], attempts=row[6] + 1)
+
+    def heartbeat(self, task_id: int, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> bool:
+        now = time.time()
+        with self._connection() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = 'leased'",
+                (now + lease_seconds, now, task_id, worker_id),
+            )
+        # False means the lease was lost and another worker may own the task.
+        return cur.rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str, result: list) -> bool:
+        with self._connection() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, error = NULL, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = 'leased'",
+                (json.dumps(result), time.time(), task_id, worker_id),
+            )
+        return cur.rowcount == 1
+
+    def fail(self, task_id: int, worker_id: str, error: str) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, worker_id = NULL, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = 'leased'",
+                (self.max_attempts, error, time.time(), task_id, worker_id),
+            )
+
+    def cancel(self, job_id: str) -> int:
+        # Drops the job's tasks no worker has picked up yet; leased ones finish
+        with self._connection() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = 'cancelled', updated_at = ? WHERE job_id = ? AND status = 'pending'",
+                (time.time(), job_id),
+            )
+        return cur.rowcount
+
+    def prune(self, older_than: float = RETENTION_SECONDS) -> int:
+        # Deletes jobs with no task left to run that nobody has touched lately
+        with self._connection() as conn:
+            cur = conn.execute(
+                "DELETE FROM tasks WHERE job_id IN ("
+                "SELECT job_id FROM tasks GROUP BY job_id "
+                "HAVING SUM(status IN ('pending', 'leased')) = 0 AND MAX(updated_at) < ?)",
+                (time.time() - older_than,),
+            )
+        return cur.rowcount
+
+    def job_status(self, job_id: str) -> dict:
+        with self._connection() as conn:
+            self._reclaim_expired(conn, time.time())
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        total = sum(counts.values())
+        finished = counts.get("done", 0) + counts.get("failed", 0) + counts.get("cancelled", 0)
+        return {
+            "job_id": job_id,
+            "total": total,
+            "pending": counts.get("pending", 0),
+            "leased": counts.get("leased", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "cancelled": counts.get("cancelled", 0),
+            "finished": total > 0 and finished == total,
+        }
+
+    def job_results(self, job_id: str) -> list[tuple[dict, list]]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT site, query, page, url, status, result, error FROM tasks "
+                "WHERE job_id = ? ORDER BY id", (job_id,)
+            ).fetchall()
+        results = []
+        for site, query, page, url, status, result, error in rows:
+            task = {"site": site, "query": query, "page": page, "url": url, "status": status, "error": error}
+            results.append((task, json.loads(result) if result else []))
+        return results
+
+
+# ------------------ Backend registry ------------------
+
+_backends: dict[str, Callable[[str], WorkQueue]] = {
+    "sqlite": lambda url: SQLiteWorkQueue(url[len("sqlite:///"):]),
+}
+
+
+def register_backend(scheme: str, factory: Callable[[str], WorkQueue]):
+    _backends[scheme] = factory
+
+
+_queues: dict[str, WorkQueue] = {}
+
+
+def get_work_queue(url: str = WORK_QUEUE_URL) -> WorkQueue:
+    if url not in _queues:
+        scheme = url.split(":", 1)[0]
+        if scheme not in _backends:
+            raise ValueError(f"Unsupported work queue backend '{scheme}'")
+        logging.info(f"Using work queue {url}")
+        _queues[url] = _backends[scheme](url)
+    return _queues[url]